@@ -0,0 +1,105 @@
+"""
+Benchmarks decrypting a local file with chunks.ChunkReader against reading
+it block by block with read().
+
+Encrypts a file of random data with a throwaway key and decrypts it with
+every available crypto backend, reporting throughput and the peak memory
+allocated by python while decrypting:
+
+    python benchmarks/chunk_reader.py /tmp --size 256M
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from rclone_decrypt import chunks
+from rclone_decrypt import crypt
+from rclone_decrypt import crypto
+
+
+def parse_size(value: str) -> int:
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    if value[-1].upper() in units:
+        return int(value[:-1]) * units[value[-1].upper()]
+    return int(value)
+
+
+def encrypt_file(cipher: crypt.Cipher, path: str, size: int) -> None:
+    nonce = os.urandom(crypt.FILE_NONCE_SIZE)
+    data = os.urandom(crypt.BLOCK_DATA_SIZE)
+    with open(path, "wb") as f:
+        f.write(crypt.FILE_MAGIC + nonce)
+        for start in range(0, size, crypt.BLOCK_DATA_SIZE):
+            n = min(crypt.BLOCK_DATA_SIZE, size - start)
+            f.write(
+                cipher.backend.secretbox_seal(cipher.data_key, nonce, data[:n])
+            )
+            nonce = cipher.nonce_add(nonce, 1)
+
+
+def read_decrypt(cipher: crypt.Cipher, path: str) -> int:
+    total = 0
+    with open(path, "rb") as fin:
+        for block in cipher.decrypt_blocks(fin):
+            total += len(block)
+    return total
+
+
+def mapped_decrypt(cipher: crypt.Cipher, path: str) -> int:
+    total = 0
+    with chunks.ChunkReader(path) as reader:
+        for block in chunks.decrypt_chunks(cipher, reader):
+            total += len(block)
+    return total
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("directory", help="where to write the test file")
+    parser.add_argument("--size", type=parse_size, default="256M")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.directory) as temp_dir:
+        path = os.path.join(temp_dir, "file.bin")
+        encrypt_file(
+            crypt.Cipher(b"benchmark", backend=crypto.get_backend()),
+            path,
+            args.size,
+        )
+
+        for name in crypto.available_backends():
+            cipher = crypt.Cipher(
+                b"benchmark", backend=crypto.get_backend(name)
+            )
+            size = args.size
+            if name != "nacl":
+                # The python salsa20 is too slow for the full file
+                size = min(size, 256 * 1024)
+                small_path = os.path.join(temp_dir, "small.bin")
+                encrypt_file(cipher, small_path, size)
+            else:
+                small_path = path
+
+            for label, run in [
+                ("read", read_decrypt),
+                ("mmap", mapped_decrypt),
+            ]:
+                start = time.perf_counter()
+                run(cipher, small_path)
+                elapsed = time.perf_counter() - start
+
+                tracemalloc.start()
+                run(cipher, small_path)
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                print(
+                    f"{name:13} {label}  {size / elapsed / 1024**2:8.1f} MiB/s"
+                    f"  peak python allocations {peak / 1024:6.1f}KiB"
+                )
+
+
+if __name__ == "__main__":
+    main()
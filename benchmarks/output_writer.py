@@ -0,0 +1,84 @@
+"""
+Benchmarks writer.OutputWriter against plain block by block writes.
+
+Writes the same set of files, chunked in 64KiB plaintext blocks like the
+native engine produces them, into a directory on the filesystem under test:
+
+    python benchmarks/output_writer.py /mnt/xfs/bench --files 200 --size 4M
+"""
+import argparse
+import os
+import shutil
+import time
+
+from rclone_decrypt import crypt
+from rclone_decrypt import writer
+
+
+def parse_size(value: str) -> int:
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    if value[-1].upper() in units:
+        return int(value[:-1]) * units[value[-1].upper()]
+    return int(value)
+
+
+def blocks(size: int, block: bytes):
+    full, rest = divmod(size, len(block))
+    for _ in range(full):
+        yield block
+    if rest:
+        yield block[:rest]
+
+
+def plain_write(out_dir: str, files: int, size: int, block: bytes) -> None:
+    for i in range(files):
+        with open(os.path.join(out_dir, f"f{i}"), "wb") as f:
+            for chunk in blocks(size, block):
+                f.write(chunk)
+
+
+def writer_write(
+    out_dir: str, files: int, size: int, block: bytes, fsync: str
+) -> None:
+    with writer.OutputWriter(fsync) as output:
+        for i in range(files):
+            output.write_file(
+                os.path.join(out_dir, f"f{i}"), size, blocks(size, block)
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("directory", help="scratch directory to write into")
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--size", type=parse_size, default="4M")
+    args = parser.parse_args()
+
+    block = os.urandom(crypt.BLOCK_DATA_SIZE)
+    total = args.files * args.size
+    runs = [("plain", lambda d: plain_write(d, args.files, args.size, block))]
+    for fsync in writer.fsync_choices:
+        runs.append(
+            (
+                f"writer fsync={fsync}",
+                lambda d, fsync=fsync: writer_write(
+                    d, args.files, args.size, block, fsync
+                ),
+            )
+        )
+
+    for name, run in runs:
+        out_dir = os.path.join(args.directory, "output_writer_bench")
+        os.makedirs(out_dir)
+        try:
+            start = time.perf_counter()
+            run(out_dir)
+            elapsed = time.perf_counter() - start
+        finally:
+            shutil.rmtree(out_dir)
+
+        print(f"{name:20} {total / elapsed / 1024**2:8.1f} MiB/s")
+
+
+if __name__ == "__main__":
+    main()
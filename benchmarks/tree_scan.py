@@ -0,0 +1,68 @@
+"""
+Benchmarks listing a directory tree with scan.walk against os.walk.
+
+Lists an existing tree, such as one on a network mount where the
+difference shows, or creates a throwaway one of empty files:
+
+    python benchmarks/tree_scan.py /mnt/backup
+    python benchmarks/tree_scan.py /tmp --create 200
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from rclone_decrypt import scan
+
+
+def create_tree(top: str, dirs: int, files: int) -> None:
+    for i in range(dirs):
+        d = os.path.join(top, f"dir{i // 20}", f"dir{i}")
+        os.makedirs(d)
+        for j in range(files):
+            open(os.path.join(d, f"file{j}"), "wb").close()
+
+
+def time_walk(top: str, threads: int) -> tuple:
+    start = time.perf_counter()
+    first = None
+    count = 0
+    if threads:
+        for _, _, files in scan.walk(top, threads=threads):
+            count += len(files)
+            if first is None and files:
+                first = time.perf_counter() - start
+    else:
+        for _, _, files in os.walk(top):
+            count += len(files)
+            if first is None and files:
+                first = time.perf_counter() - start
+    return count, first or 0.0, time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("directory", help="tree to list, or where to create")
+    parser.add_argument(
+        "--create", type=int, metavar="DIRS", help="create a tree of DIRS dirs"
+    )
+    parser.add_argument("--files", type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.directory) as temp_dir:
+        top = args.directory
+        if args.create:
+            top = temp_dir
+            create_tree(top, args.create, args.files)
+
+        for threads in [0, 4, scan.default_threads]:
+            label = f"scan.walk x{threads}" if threads else "os.walk"
+            count, first, total = time_walk(top, threads)
+            print(
+                f"{label:14} {count} files in {total:.3f}s, "
+                f"first files after {first * 1000:.1f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import io
+import shutil
+import sys
+import tarfile
+import time
+import zipfile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Modes for tarfile's streaming interface, which never seeks, so the
+# archive can be written to a pipe
+tar_stream_modes = {
+    ".tar": "w|",
+    ".tar.gz": "w|gz",
+    ".tgz": "w|gz",
+    ".tar.bz2": "w|bz2",
+    ".tar.xz": "w|xz",
+    ".tar.zst": "w|",
+}
+
+archive_suffixes = list(tar_stream_modes) + [".zip"]
+
+copy_buffer_size = 1024 * 1024
+
+
+class ArchiveError(Exception):
+    def __init__(self, *args, **kwargs):
+        default_message = f"""The output archive must end with one of:
+        {', '.join(archive_suffixes)}, or be - for stdout"""
+
+        if not args:
+            args = (default_message,)
+
+        # Call super constructor
+        super().__init__(*args, **kwargs)
+
+
+class BlockReader(io.RawIOBase):
+    """
+    A read only file object returning the bytes of an iterator of blocks,
+    such as the plaintext of a file being decrypted. A block is only read
+    once the previous one is used up, so blocks which are only valid until
+    the next one is yielded are fine.
+    """
+
+    def __init__(self, blocks) -> None:
+        super().__init__()
+        self.blocks = iter(blocks)
+        self.block = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not len(self.block):
+            try:
+                self.block = memoryview(next(self.blocks))
+            except StopIteration:
+                return 0
+
+        n = min(len(b), len(self.block))
+        b[:n] = self.block[:n]
+        self.block = self.block[n:]
+        return n
+
+
+def open_blocks(blocks):
+    """
+    Returns a buffered file object over the blocks, whose reads only come
+    back short at the end like tarfile expects.
+    """
+    return io.BufferedReader(BlockReader(blocks), copy_buffer_size)
+
+
+class TarArchiveWriter:
+    """
+    Streams files into a tar archive, optionally compressed.
+    """
+
+    def __init__(
+        self,
+        fileobj,
+        mode: str = "w|",
+        zstd: bool = False,
+        close_fileobj: bool = False,
+    ):
+        self.fileobj = fileobj if close_fileobj else None
+        self.zstd_writer = None
+        if zstd:
+            if zstandard is None:
+                raise ArchiveError(
+                    "Writing .tar.zst archives needs the zstandard package"
+                )
+            self.zstd_writer = zstandard.ZstdCompressor().stream_writer(
+                fileobj, closefd=False
+            )
+            fileobj = self.zstd_writer
+
+        self.tar = tarfile.open(
+            fileobj=fileobj, mode=mode, format=tarfile.PAX_FORMAT
+        )
+
+    def add(self, name: str, size: int, mtime: float, fileobj) -> None:
+        """
+        Adds a file of known size whose contents are read from fileobj.
+        """
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = mtime
+        info.mode = 0o644
+        self.tar.addfile(info, fileobj)
+
+    def close(self) -> None:
+        self.tar.close()
+        if self.zstd_writer is not None:
+            self.zstd_writer.close()
+        if self.fileobj is not None:
+            self.fileobj.close()
+
+    def abort(self) -> None:
+        """
+        Stops writing without the end of archive marker, so a truncated
+        archive is not mistaken for a complete one.
+        """
+        self.tar.closed = True
+        # The stream tarfile writes through would finish the archive when
+        # it is garbage collected
+        self.tar.fileobj.closed = True
+        if self.fileobj is not None:
+            self.fileobj.close()
+
+
+class ZipArchiveWriter:
+    """
+    Streams files into an uncompressed zip archive. zipfile writes data
+    descriptors when the output is not seekable, so this works on pipes too.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = None
+        if isinstance(fileobj, str):
+            fileobj = self.fileobj = open(fileobj, "wb")
+        self.zip = zipfile.ZipFile(fileobj, "w", zipfile.ZIP_STORED)
+
+    def add(self, name: str, size: int, mtime: float, fileobj) -> None:
+        # zip timestamps cannot predate 1980
+        date_time = time.localtime(max(mtime, 315532800))[:6]
+        info = zipfile.ZipInfo(name, date_time)
+        info.file_size = size
+        info.external_attr = 0o644 << 16
+
+        with self.zip.open(
+            info, "w", force_zip64=size >= zipfile.ZIP64_LIMIT
+        ) as dest:
+            shutil.copyfileobj(fileobj, dest, copy_buffer_size)
+
+    def close(self) -> None:
+        self.zip.close()
+        if self.fileobj is not None:
+            self.fileobj.close()
+
+    def abort(self) -> None:
+        """
+        Stops writing without the central directory, so a truncated archive
+        is not mistaken for a complete one.
+        """
+        # With no fp left, zipfile has nothing to finish on close
+        self.zip.fp = None
+        if self.fileobj is not None:
+            self.fileobj.close()
+
+
+def open_archive(path: str, fileobj=None):
+    """
+    Returns an archive writer for path, with the format picked from its
+    suffix. "-" writes an uncompressed tar to stdout. If fileobj is given
+    it is written to instead of opening path.
+    """
+    if path == "-":
+        return TarArchiveWriter(fileobj or sys.stdout.buffer)
+
+    lower = path.lower()
+    if lower.endswith(".zip"):
+        return ZipArchiveWriter(fileobj or path)
+
+    for suffix, mode in tar_stream_modes.items():
+        if lower.endswith(suffix):
+            if fileobj is not None:
+                return TarArchiveWriter(fileobj, mode, suffix == ".tar.zst")
+            return TarArchiveWriter(
+                open(path, "wb"), mode, suffix == ".tar.zst", True
+            )
+
+    raise ArchiveError()
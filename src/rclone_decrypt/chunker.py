@@ -0,0 +1,384 @@
+import collections
+import concurrent.futures
+import configparser
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import re
+
+import rclone_decrypt.crypt as crypt
+from rclone_decrypt.crypto import DecryptionError
+
+logger = logging.getLogger("rclone_decrypt")
+
+# rclone chunker defaults, see https://rclone.org/chunker/
+default_name_format = "*.rclone_chunk.###"
+default_start_from = 1
+
+# Metadata objects are a few dozen bytes of JSON, anything bigger is data
+max_meta_size = 1024
+
+default_threads = min(8, os.cpu_count() or 1)
+
+# Blocks decrypted ahead of the one being written, per thread
+read_ahead_blocks = 4
+
+
+class ChunkNaming:
+    """
+    Parses chunk names of a chunker name_format, where * is the name of the
+    composite file and # a digit of the chunk number.
+    """
+
+    def __init__(
+        self,
+        name_format: str = default_name_format,
+        start_from: int = default_start_from,
+    ) -> None:
+        digits = name_format.count("#")
+        if name_format.count("*") != 1 or not digits:
+            raise ValueError(f"Invalid chunker name_format: {name_format}")
+
+        pattern = ""
+        hidden = ""
+        for part in re.split(r"(\*|#+)", name_format):
+            if part == "*":
+                pattern += "(?P<base>.+?)"
+                hidden += ".+?"
+            elif part.startswith("#"):
+                pattern += rf"(?P<number>\d{{{len(part)},}})"
+                # Temporary chunks of unfinished uploads and control chunks
+                hidden += r"(?:\d+_[0-9a-z]{4,9}|_[a-z][a-z0-9]{2,6})"
+            else:
+                pattern += re.escape(part)
+                hidden += re.escape(part)
+
+        self.name_format = name_format
+        self.start_from = start_from
+        self.regex = re.compile(f"^{pattern}$")
+        self.hidden_regex = re.compile(f"^{hidden}$")
+
+    def parse(self, name: str):
+        """
+        Returns (composite name, chunk index from 0) for a chunk name, or
+        None if name is not a chunk.
+        """
+        match = self.regex.match(name)
+        if match is None:
+            return None
+        index = int(match.group("number")) - self.start_from
+        return match.group("base"), index
+
+    def is_hidden(self, name: str) -> bool:
+        """
+        Whether name is a chunk chunker does not show, which is skipped.
+        """
+        return self.hidden_regex.match(name) is not None
+
+
+def read_chunker_remotes(config: str) -> dict:
+    """
+    Returns the options of every chunker entry in the rclone config, keyed
+    by remote name. A config which cannot be read has none.
+    """
+    parser = configparser.ConfigParser(interpolation=None, strict=False)
+    try:
+        with open(config, "r") as f:
+            parser.read_file(f)
+    except (OSError, configparser.Error) as err:
+        logger.debug(f"Could not read chunker entries of {config}: {err}")
+
+    return {
+        name: dict(parser[name])
+        for name in parser.sections()
+        if parser[name].get("type", "").strip() == "chunker"
+    }
+
+
+def read_namings(config: str) -> list:
+    """
+    Returns the ChunkNaming of every chunker entry in the rclone config,
+    followed by the default naming which is always recognized.
+    """
+    namings = []
+    for name, options in read_chunker_remotes(config).items():
+        try:
+            namings.append(
+                ChunkNaming(
+                    options.get("name_format", default_name_format).strip(),
+                    int(options.get("start_from", default_start_from)),
+                )
+            )
+        except ValueError as err:
+            logger.warning(f"Ignoring chunker remote {name}: {err}")
+
+    namings.append(ChunkNaming())
+    return namings
+
+
+def composite_path(path: str, namings: list):
+    """
+    Returns the "/" separated path with its file name replaced by the name
+    of the file it is a chunk of, path itself if it is not a chunk, or None
+    if it is a chunk chunker does not show.
+    """
+    head, name = posixpath.split(path)
+    for naming in namings:
+        if naming.is_hidden(name):
+            return None
+        parsed = naming.parse(name)
+        if parsed is not None:
+            return posixpath.join(head, parsed[0])
+    return path
+
+
+# Options of a chunker entry which change how existing chunks are read
+layer_options = ["name_format", "start_from", "meta_format"]
+
+
+def layer_name(remote: str) -> str:
+    """
+    Name of the chunker remote layer_config puts over the crypt remote.
+    """
+    return f"{remote}_rclone_decrypt_chunker"
+
+
+def layer_config(config: str, remotes: list) -> str:
+    """
+    Returns rclone config entries putting a chunker remote over each crypt
+    remote in remotes, so that copying from it joins the chunks of files
+    split by a chunker remote over that crypt remote. Files which were not
+    split pass through unchanged. The options that decide how chunks are
+    named are taken from the chunker entry of the config over the crypt
+    remote, if there is one.
+    """
+    wrapped = {}
+    for options in read_chunker_remotes(config).values():
+        target = options.get("remote", "").strip().split(":", 1)[0]
+        wrapped[target] = options
+
+    entries = []
+    for remote in remotes:
+        lines = [
+            f"[{layer_name(remote)}]",
+            "type = chunker",
+            f"remote = {remote}:",
+        ]
+        options = wrapped.get(remote, {})
+        for key in layer_options:
+            if key in options:
+                lines.append(f"{key} = {options[key].strip()}")
+        entries.append("\n".join(lines) + "\n")
+
+    return "\n".join(entries)
+
+
+class ChunkedFile:
+    """
+    The encrypted parts of a file split by rclone chunker, in order, and
+    the decrypted metadata object chunker stored next to them, if any.
+    """
+
+    def __init__(self, parts: list, meta: dict = None) -> None:
+        self.parts = parts
+        self.meta = meta
+
+    def __str__(self) -> str:
+        return f"{self.parts[0]} (+{len(self.parts) - 1} chunks)"
+
+    def dumps(self) -> str:
+        """
+        Serializes the parts and metadata to a JSON object, which can never
+        be mistaken for an absolute path, see loads.
+        """
+        return json.dumps({"parts": self.parts, "meta": self.meta})
+
+    @classmethod
+    def loads(cls, src: str):
+        """
+        Returns the ChunkedFile serialized by dumps in src, or src itself if
+        it is an ordinary path.
+        """
+        if not src.startswith("{"):
+            return src
+        data = json.loads(src)
+        return cls(data["parts"], data["meta"])
+
+    def stat(self) -> os.stat_result:
+        return os.stat(self.parts[0])
+
+    def decrypted_size(self, cipher: crypt.Cipher) -> int:
+        return sum(
+            cipher.decrypted_size(os.stat(p).st_size) for p in self.parts
+        )
+
+    def check(self, cipher: crypt.Cipher) -> None:
+        """
+        Raises DecryptionError if the parts do not add up to the file
+        described by the metadata object.
+        """
+        if self.meta is None:
+            return
+
+        nchunks = self.meta.get("nchunks")
+        if nchunks is not None and nchunks != len(self.parts):
+            raise DecryptionError(
+                f"Expected {nchunks} chunks, found {len(self.parts)}"
+            )
+
+        size = self.meta.get("size")
+        if size is not None and size != self.decrypted_size(cipher):
+            raise DecryptionError(
+                f"Expected {size} bytes, the chunks hold "
+                f"{self.decrypted_size(cipher)}"
+            )
+
+    def blocks(self, cipher: crypt.Cipher, threads: int = default_threads):
+        """
+        Yields the plaintext of the whole file in order, see decrypt_parts.
+        The md5 in the metadata object, if any, is checked at the end.
+        """
+        self.check(cipher)
+
+        md5 = None
+        if self.meta is not None and self.meta.get("md5"):
+            md5 = hashlib.md5()
+
+        for block in decrypt_parts(cipher, self.parts, threads):
+            if md5 is not None:
+                md5.update(block)
+            yield block
+
+        if md5 is not None and md5.hexdigest() != self.meta["md5"]:
+            raise DecryptionError("md5 of the joined chunks does not match")
+
+
+def decrypt_parts(
+    cipher: crypt.Cipher, parts: list, threads: int = default_threads
+):
+    """
+    Yields the plaintext of the encrypted files parts one block at a time,
+    as if they were a single file. Blocks are read in order, and read ahead
+    of the one being yielded, across part boundaries, so up to
+    threads * read_ahead_blocks of them are decrypted concurrently.
+    """
+
+    def blocks():
+        for part in parts:
+            with open(part, "rb") as fin:
+                nonce = cipher.read_header(fin.read(crypt.FILE_HEADER_SIZE))
+                while True:
+                    block = fin.read(crypt.BLOCK_SIZE)
+                    if not block:
+                        break
+                    if len(block) <= crypt.BLOCK_HEADER_SIZE:
+                        raise DecryptionError("File has a truncated block")
+                    yield nonce, block
+                    nonce = cipher.nonce_add(nonce, 1)
+
+    if threads <= 1:
+        for nonce, block in blocks():
+            yield cipher.decrypt_block(nonce, block)
+        return
+
+    window = threads * read_ahead_blocks
+    pending = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+        try:
+            for nonce, block in blocks():
+                pending.append(pool.submit(cipher.decrypt_block, nonce, block))
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def read_meta(cipher: crypt.Cipher, path: str):
+    """
+    Returns the decrypted chunker metadata object at path, or None if it is
+    not one.
+    """
+    try:
+        if os.path.getsize(path) > max_meta_size:
+            return None
+        with open(path, "rb") as fin:
+            meta = json.loads(b"".join(cipher.decrypt_blocks(fin)))
+    except (OSError, ValueError, DecryptionError):
+        return None
+
+    if not isinstance(meta, dict) or "ver" not in meta:
+        return None
+    return meta
+
+
+def group_chunks(plan, namings: list):
+    """
+    Replaces the chunks of chunker-split files in the (remote, cipher, src,
+    dst) entries of a native plan by a single entry whose src is a
+    ChunkedFile and whose dst is the composite file. A metadata object
+    next to the chunks is folded into that entry. Entries are grouped per
+    directory, so the plan is still consumed as it is generated.
+    """
+    batch = []
+    batch_key = None
+
+    for entry in plan:
+        key = (entry[0], os.path.dirname(entry[3]))
+        if key != batch_key:
+            yield from _group_batch(batch, namings)
+            batch = []
+            batch_key = key
+        batch.append(entry)
+
+    yield from _group_batch(batch, namings)
+
+
+def _group_batch(batch: list, namings: list):
+    """
+    Groups the chunks in the entries of a single directory and remote.
+    """
+    chunks = {}
+    others = []
+    for entry in batch:
+        name = os.path.basename(entry[3])
+        for naming in namings:
+            if naming.is_hidden(name):
+                logger.debug(f"Skipping {entry[3]}: hidden by chunker")
+                break
+            parsed = naming.parse(name)
+            if parsed is not None:
+                base, index = parsed
+                dst = os.path.join(os.path.dirname(entry[3]), base)
+                chunks.setdefault(dst, {})[index] = entry
+                break
+        else:
+            others.append(entry)
+
+    metas = {}
+    for entry in others:
+        remote, cipher, src, dst = entry
+        if dst in chunks:
+            meta = read_meta(cipher, src)
+            if meta is not None:
+                metas[dst] = meta
+                continue
+            logger.warning(f"{dst} is both a file and a chunked file")
+        yield entry
+
+    for dst, parts in chunks.items():
+        indices = sorted(parts)
+        if indices != list(range(len(indices))):
+            logger.error(
+                f"Skipping {dst}: chunks {indices} are not a full sequence"
+            )
+            continue
+
+        remote, cipher = parts[0][0], parts[0][1]
+        paths = [parts[i][2] for i in indices]
+        yield remote, cipher, ChunkedFile(paths, metas.get(dst)), dst
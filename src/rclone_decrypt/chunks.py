@@ -0,0 +1,126 @@
+import logging
+import mmap
+import os
+
+import rclone_decrypt.crypt as crypt
+
+logger = logging.getLogger("rclone_decrypt")
+
+
+class ChunkReader:
+    """
+    Hands out the header and encrypted blocks of a local encrypted file as
+    memoryview slices without copying them.
+
+    The file is memory mapped and the kernel told it will be read
+    sequentially. Files which cannot be mapped, such as empty files or
+    pipes, are read into a single reused buffer instead, so a block is only
+    valid until the next one is read either way.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.file = open(path, "rb", buffering=0)
+        self.stat = os.fstat(self.file.fileno())
+        self.map = None
+        self.view = None
+
+        try:
+            self.map = mmap.mmap(
+                self.file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        except (OSError, ValueError) as err:
+            logger.debug(f"Could not map {path}, reading it: {err}")
+        else:
+            if hasattr(self.map, "madvise"):
+                try:
+                    self.map.madvise(mmap.MADV_SEQUENTIAL)
+                except (AttributeError, OSError) as err:
+                    logger.debug(f"madvise failed for {path}: {err}")
+            self.view = memoryview(self.map)
+
+    def __enter__(self) -> "ChunkReader":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    @property
+    def mapped(self) -> bool:
+        return self.view is not None
+
+    def blocks(self):
+        """
+        Yields the file header followed by each encrypted block.
+        """
+        if self.mapped:
+            yield from self._mapped_blocks()
+        else:
+            yield from self._read_blocks()
+
+    def _mapped_blocks(self):
+        view = self.view
+        size = len(view)
+        yield view[: min(size, crypt.FILE_HEADER_SIZE)]
+
+        for start in range(crypt.FILE_HEADER_SIZE, size, crypt.BLOCK_SIZE):
+            end = start + crypt.BLOCK_SIZE
+            yield view[start:end]
+
+    def _read_blocks(self):
+        buffer = bytearray(crypt.BLOCK_SIZE)
+        view = memoryview(buffer)
+
+        n = self._fill(view[: crypt.FILE_HEADER_SIZE])
+        yield view[:n]
+
+        while True:
+            n = self._fill(view)
+            if not n:
+                break
+            yield view[:n]
+
+    def _fill(self, view) -> int:
+        """
+        Reads until view is full or the file ends, returns the bytes read.
+        """
+        filled = 0
+        while filled < len(view):
+            n = self.file.readinto(view[filled:])
+            if not n:
+                break
+            filled += n
+        return filled
+
+    def close(self) -> None:
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                # A caller still holds a block, the map is closed when it
+                # is garbage collected
+                logger.debug("Mapped blocks still in use")
+            self.map = None
+        self.file.close()
+
+
+def decrypt_chunks(cipher: crypt.Cipher, reader: ChunkReader):
+    """
+    Yields the plaintext of each block of the file read by reader, decrypted
+    from the mapped ciphertext into one reused buffer. Each plaintext block
+    is only valid until the next one is yielded.
+    """
+    blocks = reader.blocks()
+    nonce = cipher.read_header(bytes(next(blocks)))
+
+    out = bytearray(crypt.BLOCK_DATA_SIZE)
+    view = memoryview(out)
+    for block in blocks:
+        if len(block) <= crypt.BLOCK_HEADER_SIZE:
+            raise crypt.DecryptionError("File has a truncated block")
+
+        n = cipher.decrypt_block_into(nonce, block, out)
+        yield view[:n]
+        nonce = cipher.nonce_add(nonce, 1)
@@ -1,7 +1,13 @@
 import click
 
+import rclone_decrypt.archive as archive
+import rclone_decrypt.crypto as crypto
 import rclone_decrypt.decrypt as decrypt
+import rclone_decrypt.dedup as dedup
 import rclone_decrypt.gui as gui
+import rclone_decrypt.serve as serve
+import rclone_decrypt.tuning as tuning
+import rclone_decrypt.writer as writer
 
 
 help_str_config = f"""config file. default config file is:
@@ -10,19 +16,87 @@ help_str_output = f"""output dir in which to put files. default folder is:
                    {decrypt.default_output_dir}"""
 
 
-@click.command()
+@click.group(invoke_without_command=True)
+@click.pass_context
 @click.option(
     "--config",
     help=help_str_config,
     default=decrypt.default_rclone_conf_dir,
     required=False,
 )
-@click.option("--files", help="dir or file to decrypt", default=None)
+@click.option(
+    "--files",
+    help="dir or file to decrypt, can be given more than once",
+    multiple=True,
+)
 @click.option(
     "--output_dir",
     help=help_str_output,
     default=decrypt.default_output_dir,
 )
+@click.option(
+    "--engine",
+    type=click.Choice(decrypt.engine_choices),
+    help="decrypt with rclone or natively in python without rclone",
+    default="rclone",
+)
+@click.option(
+    "--crypto-backend",
+    "crypto_backend",
+    type=click.Choice(crypto.backend_choices),
+    help="crypto library used by the native engine. auto picks the fastest",
+    default="auto",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=0),
+    help="native engine worker processes, 0 starts one per CPU",
+    default=1,
+)
+@click.option(
+    "--queue",
+    help="""SQLite work queue file. put it on a shared mount to let workers
+         on other hosts join with --worker""",
+    default=None,
+)
+@click.option(
+    "--worker",
+    "join_queue",
+    is_flag=True,
+    help="only decrypt files from an existing --queue",
+    default=False,
+)
+@click.option(
+    "--output-archive",
+    "output_archive",
+    help="""write the decrypted files into a .tar[.gz|.bz2|.xz|.zst] or .zip
+         archive instead of output_dir, - writes a tar to stdout. needs the
+         native engine""",
+    default=None,
+)
+@click.option(
+    "--dedup",
+    "dedup_method",
+    type=click.Choice(dedup.dedup_choices),
+    help="""decrypt files with identical ciphertext once and hardlink or
+         reflink the other copies. needs the native engine""",
+    default=None,
+)
+@click.option(
+    "--fsync",
+    type=click.Choice(writer.fsync_choices),
+    help="""how the native engine flushes decrypted files to disk: after
+         each file, in batches, or never (left to the OS)""",
+    default="never",
+)
+@click.option(
+    "--rclone-profile",
+    "rclone_profile",
+    type=click.Choice(tuning.profile_choices),
+    help="""rclone transfer tuning. auto derives it from the input's file
+         sizes and the CPU count, default keeps rclone's own settings""",
+    default="auto",
+)
 @click.option(
     "--gui",
     "use_gui",
@@ -30,18 +104,125 @@ help_str_output = f"""output dir in which to put files. default folder is:
     help="Launch the GUI",
     default=False,
 )
-def cli(config, files, output_dir, use_gui):
+def cli(
+    ctx,
+    config,
+    files,
+    output_dir,
+    engine,
+    crypto_backend,
+    workers,
+    queue,
+    join_queue,
+    output_archive,
+    dedup_method,
+    fsync,
+    rclone_profile,
+    use_gui,
+):
+    if ctx.invoked_subcommand is not None:
+        return
+
     if use_gui:
         gui.start_gui()
         return
 
     try:
-        if files is None:
+        if join_queue:
+            if queue is None:
+                raise ValueError("--worker requires --queue")
+            decrypt.run_worker(queue, config, crypto_backend, fsync=fsync)
+        elif not files:
             raise ValueError("files cannot be None")
         else:
-            decrypt.decrypt(files, config, output_dir)
+            decrypt.decrypt(
+                files[0] if len(files) == 1 else list(files),
+                config,
+                output_dir,
+                engine,
+                crypto_backend,
+                workers,
+                queue,
+                output_archive,
+                dedup_method,
+                fsync,
+                rclone_profile,
+            )
+
+    except (
+        ValueError,
+        decrypt.ConfigFileError,
+        decrypt.RCloneExecutableError,
+        crypto.CryptoBackendError,
+        crypto.DecryptionError,
+        archive.ArchiveError,
+    ) as err:
+        decrypt.print_error(err)
 
-    except (ValueError, decrypt.RCloneExecutableError) as err:
+
+@cli.command("serve")
+@click.option(
+    "--root",
+    help="encrypted dir to serve, as the root of the crypt remote",
+    required=True,
+)
+@click.option(
+    "--config",
+    help=help_str_config,
+    default=decrypt.default_rclone_conf_dir,
+)
+@click.option(
+    "--remote",
+    help="crypt remote to decrypt with. default is the one that decrypts "
+    "the most names",
+    default=None,
+)
+@click.option(
+    "--host", help="address to listen on", default=serve.default_host
+)
+@click.option(
+    "--port",
+    type=click.IntRange(0, 65535),
+    help="port to listen on",
+    default=serve.default_port,
+)
+@click.option(
+    "--crypto-backend",
+    "crypto_backend",
+    type=click.Choice(crypto.backend_choices),
+    help="crypto library used to decrypt. auto picks the fastest",
+    default="auto",
+)
+@click.option(
+    "--cache-size",
+    "cache_size",
+    type=click.IntRange(min=0),
+    help="MiB of decrypted blocks kept in memory",
+    default=serve.default_cache_size // (1024 * 1024),
+)
+def serve_command(
+    root, config, remote, host, port, crypto_backend, cache_size
+):
+    """
+    Serve the decrypted names and contents of an encrypted dir over HTTP,
+    decrypting on demand. Supports Range requests.
+    """
+    try:
+        serve.serve(
+            root,
+            config,
+            host,
+            port,
+            remote,
+            crypto_backend,
+            cache_size * 1024 * 1024,
+        )
+    except (
+        OSError,
+        crypto.CryptoBackendError,
+        crypto.DecryptionError,
+        serve.ServeError,
+    ) as err:
         decrypt.print_error(err)
 
 
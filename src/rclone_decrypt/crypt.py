@@ -0,0 +1,354 @@
+import base64
+import configparser
+import functools
+import logging
+
+import rclone_decrypt.crypto as crypto
+from rclone_decrypt.crypto import DecryptionError
+
+logger = logging.getLogger("rclone_decrypt")
+
+# rclone crypt file format, see https://rclone.org/crypt/#file-formats
+FILE_MAGIC = b"RCLONE\x00\x00"
+FILE_MAGIC_SIZE = len(FILE_MAGIC)
+FILE_NONCE_SIZE = 24
+FILE_HEADER_SIZE = FILE_MAGIC_SIZE + FILE_NONCE_SIZE
+BLOCK_HEADER_SIZE = 16
+BLOCK_DATA_SIZE = 64 * 1024
+BLOCK_SIZE = BLOCK_HEADER_SIZE + BLOCK_DATA_SIZE
+
+NAME_CIPHER_BLOCK_SIZE = 16
+
+# scrypt parameters and the salt rclone uses when password2 is empty
+SCRYPT_N = 16384
+SCRYPT_R = 8
+SCRYPT_P = 1
+DEFAULT_SALT = bytes(
+    [
+        0xA8, 0x0D, 0xF4, 0x3A, 0x8F, 0xBD, 0x03, 0x08,
+        0xA7, 0xCA, 0xB8, 0x3E, 0x58, 0x1F, 0x86, 0xB1,
+    ]
+)  # fmt: skip
+
+# Key used by `rclone obscure` for the passwords stored in the config file
+OBSCURE_KEY = bytes(
+    [
+        0x9C, 0x93, 0x5B, 0x48, 0x73, 0x0A, 0x55, 0x4D,
+        0x6B, 0xFD, 0x7C, 0x63, 0xC8, 0x86, 0xA9, 0x2B,
+        0xD3, 0x90, 0x19, 0x8E, 0xB8, 0x12, 0x8A, 0xFB,
+        0xF4, 0xDE, 0x16, 0x2B, 0x8B, 0x95, 0xF6, 0x38,
+    ]
+)  # fmt: skip
+
+
+def reveal(obscured: str, backend: crypto.PythonBackend) -> bytes:
+    """
+    Reverses `rclone obscure` on a password from the config file. The result
+    is returned as bytes since rclone does not require it to be valid utf-8.
+    """
+    padding = "=" * (-len(obscured) % 4)
+    try:
+        ciphertext = base64.urlsafe_b64decode(obscured + padding)
+    except ValueError as err:
+        raise DecryptionError(f"Failed to reveal password: {err}") from err
+
+    if len(ciphertext) < 16:
+        raise DecryptionError("Failed to reveal password: input too short")
+
+    iv, buf = ciphertext[:16], ciphertext[16:]
+    return backend.aes_ctr(OBSCURE_KEY, iv, buf)
+
+
+def read_crypt_remotes(config: str) -> dict:
+    """
+    Returns the crypt type entries of an rclone config file as a dict of
+    remote name to the options of that remote.
+    """
+    parser = configparser.ConfigParser(interpolation=None, strict=False)
+    with open(config, "r") as f:
+        parser.read_file(f)
+
+    return {
+        name: dict(parser[name])
+        for name in parser.sections()
+        if parser[name].get("type", "").strip() == "crypt"
+    }
+
+
+def _eme_mult_by_two(block: bytes) -> bytes:
+    out = bytearray(16)
+    out[0] = (block[0] << 1) & 0xFF
+    if block[15] >= 0x80:
+        out[0] ^= 0x87
+    for j in range(1, 16):
+        out[j] = (block[j] << 1) & 0xFF
+        if block[j - 1] >= 0x80:
+            out[j] += 1
+    return bytes(out)
+
+
+def _xor(a: bytes, b: bytes) -> bytes:
+    return bytes(x ^ y for x, y in zip(a, b))
+
+
+def eme_decrypt(
+    backend: crypto.PythonBackend, key: bytes, tweak: bytes, data: bytes
+) -> bytes:
+    """
+    EME (ECB-Mix-ECB) wide block decryption as used by rclone for file
+    names.
+    """
+    m = len(data) // 16
+
+    # L table is always computed with the forward cipher
+    lt = []
+    li = backend.aes_ecb_encrypt(key, bytes(16))
+    for _ in range(m):
+        li = _eme_mult_by_two(li)
+        lt.append(li)
+
+    ppp = backend.aes_ecb_decrypt(
+        key,
+        b"".join(map(_xor, crypto.split_blocks(data, 16), lt)),
+    )
+    ppp = crypto.split_blocks(ppp, 16)
+
+    mp = _xor(ppp[0], tweak)
+    for j in range(1, m):
+        mp = _xor(mp, ppp[j])
+
+    mc = backend.aes_ecb_decrypt(key, mp)
+    mm = _xor(mp, mc)
+
+    ccc = [None] * m
+    for j in range(1, m):
+        mm = _eme_mult_by_two(mm)
+        ccc[j] = _xor(ppp[j], mm)
+
+    ccc0 = _xor(mc, tweak)
+    for j in range(1, m):
+        ccc0 = _xor(ccc0, ccc[j])
+    ccc[0] = ccc0
+
+    out = backend.aes_ecb_decrypt(key, b"".join(ccc))
+    return b"".join(map(_xor, crypto.split_blocks(out, 16), lt))
+
+
+# filename_encoding values _decode_name can decode
+FILENAME_ENCODINGS = ("base32", "base64")
+
+
+def _decode_name(name: str, encoding: str) -> bytes:
+    if encoding == "base32":
+        padding = "=" * (-len(name) % 8)
+        return base64.b32hexdecode(name.upper() + padding)
+    elif encoding == "base64":
+        padding = "=" * (-len(name) % 4)
+        return base64.urlsafe_b64decode(name + padding)
+    else:
+        raise DecryptionError(f"Unsupported filename_encoding: {encoding}")
+
+
+@functools.lru_cache(maxsize=None)
+def _derive_keys(
+    backend: crypto.PythonBackend, password: bytes, salt: bytes
+) -> bytes:
+    return backend.scrypt(
+        password,
+        salt,
+        SCRYPT_N,
+        SCRYPT_R,
+        SCRYPT_P,
+        32 + 32 + NAME_CIPHER_BLOCK_SIZE,
+    )
+
+
+class Cipher:
+    """
+    Decrypts file names and file contents of a single rclone crypt remote.
+    """
+
+    def __init__(
+        self,
+        password: bytes,
+        salt: bytes = b"",
+        filename_encryption: str = "standard",
+        directory_name_encryption: bool = True,
+        filename_encoding: str = "base32",
+        suffix: str = ".bin",
+        backend: crypto.PythonBackend = None,
+    ) -> None:
+        if backend is None:
+            backend = crypto.get_backend()
+
+        if filename_encryption not in ("standard", "off"):
+            raise DecryptionError(
+                f"filename_encryption = {filename_encryption} is not "
+                "supported by the native engine"
+            )
+        if (
+            filename_encryption == "standard"
+            and filename_encoding not in FILENAME_ENCODINGS
+        ):
+            raise DecryptionError(
+                f"filename_encoding = {filename_encoding} is not "
+                "supported by the native engine"
+            )
+
+        self.backend = backend
+        self.filename_encryption = filename_encryption
+        self.directory_name_encryption = directory_name_encryption
+        self.filename_encoding = filename_encoding
+        self.suffix = "" if suffix == "none" else suffix
+
+        key = _derive_keys(backend, password, salt or DEFAULT_SALT)
+        self.data_key = key[:32]
+        self.name_key = key[32:64]
+        self.name_tweak = key[64:]
+
+    @classmethod
+    def from_config(
+        cls, options: dict, backend: crypto.PythonBackend = None
+    ) -> "Cipher":
+        """
+        Creates a Cipher from the options of a crypt entry in the rclone
+        config file.
+        """
+        if backend is None:
+            backend = crypto.get_backend()
+
+        password = options.get("password", "")
+        if not password:
+            raise DecryptionError("crypt remote has no password")
+
+        salt = options.get("password2", "")
+
+        return cls(
+            reveal(password, backend),
+            reveal(salt, backend) if salt else b"",
+            options.get("filename_encryption", "standard").strip(),
+            options.get("directory_name_encryption", "true").strip().lower()
+            == "true",
+            options.get("filename_encoding", "base32").strip(),
+            options.get("suffix", ".bin").strip(),
+            backend,
+        )
+
+    def decrypt_segment(self, name: str) -> str:
+        """
+        Decrypts a single standard encrypted path segment.
+        """
+        if not name:
+            return name
+
+        try:
+            raw = _decode_name(name, self.filename_encoding)
+        except ValueError as err:
+            raise DecryptionError(f"Invalid encrypted name: {name}") from err
+
+        if not raw or len(raw) % NAME_CIPHER_BLOCK_SIZE != 0:
+            raise DecryptionError(f"Invalid encrypted name: {name}")
+
+        padded = eme_decrypt(self.backend, self.name_key, self.name_tweak, raw)
+
+        # PKCS#7 unpadding
+        pad = padded[-1]
+        if (
+            pad == 0
+            or pad > NAME_CIPHER_BLOCK_SIZE
+            or padded[-pad:] != bytes([pad]) * pad
+        ):
+            raise DecryptionError(f"Invalid encrypted name: {name}")
+
+        try:
+            return padded[:-pad].decode()
+        except UnicodeDecodeError as err:
+            raise DecryptionError(f"Invalid encrypted name: {name}") from err
+
+    def decrypt_file_name(self, name: str) -> str:
+        if self.filename_encryption == "off":
+            if not self.suffix:
+                return name
+            if len(name) <= len(self.suffix) or not name.endswith(self.suffix):
+                raise DecryptionError(f"Not an encrypted file: {name}")
+            return name[: -len(self.suffix)]
+
+        return self.decrypt_segment(name)
+
+    def decrypt_dir_name(self, name: str) -> str:
+        if (
+            self.filename_encryption == "off"
+            or not self.directory_name_encryption
+        ):
+            return name
+
+        return self.decrypt_segment(name)
+
+    @staticmethod
+    def decrypted_size(size: int) -> int:
+        """
+        Returns the plaintext size of an encrypted file of the given size.
+        """
+        size -= FILE_HEADER_SIZE
+        if size < 0:
+            raise DecryptionError("File is too short to be encrypted")
+
+        blocks, residue = divmod(size, BLOCK_SIZE)
+        decrypted = blocks * BLOCK_DATA_SIZE
+        if residue:
+            if residue <= BLOCK_HEADER_SIZE:
+                raise DecryptionError("File has a truncated block")
+            decrypted += residue - BLOCK_HEADER_SIZE
+
+        return decrypted
+
+    @staticmethod
+    def read_header(header: bytes) -> bytes:
+        """
+        Validates the file header and returns the initial nonce.
+        """
+        if len(header) < FILE_HEADER_SIZE:
+            raise DecryptionError("File is too short to be encrypted")
+        if header[:FILE_MAGIC_SIZE] != FILE_MAGIC:
+            raise DecryptionError("Not an encrypted file: bad magic")
+
+        return bytes(header[FILE_MAGIC_SIZE:FILE_HEADER_SIZE])
+
+    @staticmethod
+    def nonce_add(nonce: bytes, n: int) -> bytes:
+        """
+        Adds n to the little endian nonce, as rclone does once per block.
+        """
+        value = (int.from_bytes(nonce, "little") + n) % (
+            1 << (8 * FILE_NONCE_SIZE)
+        )
+        return value.to_bytes(FILE_NONCE_SIZE, "little")
+
+    def decrypt_block(self, nonce: bytes, block) -> bytes:
+        return self.backend.secretbox_open(self.data_key, nonce, block)
+
+    def decrypt_block_into(self, nonce: bytes, block, out) -> int:
+        """
+        Decrypts block into the writable buffer out and returns the length
+        of the plaintext.
+        """
+        return self.backend.secretbox_open_into(
+            self.data_key, nonce, block, out
+        )
+
+    def decrypt_blocks(self, fin):
+        """
+        Reads the encrypted file object fin and yields its plaintext one
+        block at a time.
+        """
+        nonce = self.read_header(fin.read(FILE_HEADER_SIZE))
+
+        while True:
+            block = fin.read(BLOCK_SIZE)
+            if not block:
+                break
+            if len(block) <= BLOCK_HEADER_SIZE:
+                raise DecryptionError("File has a truncated block")
+
+            yield self.decrypt_block(nonce, block)
+            nonce = self.nonce_add(nonce, 1)
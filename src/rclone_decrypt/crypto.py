@@ -0,0 +1,770 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import platform
+import struct
+import sys
+import time
+
+try:
+    import nacl
+    import nacl.bindings as nacl_bindings
+    import nacl.exceptions as nacl_exceptions
+except ImportError:
+    nacl_bindings = None
+
+try:
+    # libsodium's cffi bindings, to decrypt between caller owned buffers
+    # without the copies nacl.bindings makes
+    from nacl._sodium import ffi as nacl_ffi
+    from nacl._sodium import lib as nacl_lib
+except ImportError:
+    nacl_lib = None
+
+try:
+    import cryptography
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import poly1305
+    from cryptography.hazmat.primitives.ciphers import (
+        Cipher,
+        algorithms,
+        modes,
+    )
+    from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+except ImportError:
+    cryptography = None
+
+logger = logging.getLogger("rclone_decrypt")
+
+if sys.platform == "win32":
+    default_cache_dir = os.path.join(
+        os.environ.get("LOCALAPPDATA", os.path.expanduser("~")),
+        "rclone-decrypt",
+    )
+else:
+    default_cache_dir = os.path.join(
+        os.environ.get(
+            "XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")
+        ),
+        "rclone-decrypt",
+    )
+
+benchmark_cache_path = os.path.join(default_cache_dir, "crypto_backend.json")
+
+# Size of a single rclone crypt data block, used for the micro-benchmark
+BENCHMARK_MESSAGE_SIZE = 64 * 1024
+BENCHMARK_MIN_SECONDS = 0.02
+
+
+class CryptoBackendError(Exception):
+    def __init__(self, *args, **kwargs):
+        default_message = """The requested crypto backend is not
+        available"""
+
+        if not args:
+            args = (default_message,)
+
+        # Call super constructor
+        super().__init__(*args, **kwargs)
+
+
+class DecryptionError(Exception):
+    def __init__(self, *args, **kwargs):
+        default_message = """Failed to authenticate the encrypted data.
+        Check the password and password2 of the crypt remote."""
+
+        if not args:
+            args = (default_message,)
+
+        # Call super constructor
+        super().__init__(*args, **kwargs)
+
+
+def _xor(a: bytes, b: bytes) -> bytes:
+    """
+    xor two equal length byte strings.
+    """
+    n = len(a)
+    return (
+        int.from_bytes(a, "little") ^ int.from_bytes(b, "little")
+    ).to_bytes(n, "little")
+
+
+def split_blocks(data, size: int) -> list:
+    """
+    Splits a sequence into size long pieces, the last one may be shorter.
+    """
+    blocks = []
+    for start in range(0, len(data), size):
+        end = start + size
+        blocks.append(data[start:end])
+    return blocks
+
+
+# --- Salsa20 ---
+
+_SIGMA = struct.unpack("<4I", b"expand 32-byte k")
+_MASK = 0xFFFFFFFF
+
+
+def _salsa20_rounds(x: list, rounds: int) -> list:
+    """
+    Runs the salsa20 double rounds over a 16 word state and returns the
+    permuted state without the final feed-forward addition.
+    """
+    x0, x1, x2, x3, x4, x5, x6, x7 = x[0:8]
+    x8, x9, x10, x11, x12, x13, x14, x15 = x[8:16]
+    m = _MASK
+
+    for _ in range(rounds // 2):
+        # column round
+        t = (x0 + x12) & m
+        x4 ^= ((t << 7) | (t >> 25)) & m
+        t = (x4 + x0) & m
+        x8 ^= ((t << 9) | (t >> 23)) & m
+        t = (x8 + x4) & m
+        x12 ^= ((t << 13) | (t >> 19)) & m
+        t = (x12 + x8) & m
+        x0 ^= ((t << 18) | (t >> 14)) & m
+
+        t = (x5 + x1) & m
+        x9 ^= ((t << 7) | (t >> 25)) & m
+        t = (x9 + x5) & m
+        x13 ^= ((t << 9) | (t >> 23)) & m
+        t = (x13 + x9) & m
+        x1 ^= ((t << 13) | (t >> 19)) & m
+        t = (x1 + x13) & m
+        x5 ^= ((t << 18) | (t >> 14)) & m
+
+        t = (x10 + x6) & m
+        x14 ^= ((t << 7) | (t >> 25)) & m
+        t = (x14 + x10) & m
+        x2 ^= ((t << 9) | (t >> 23)) & m
+        t = (x2 + x14) & m
+        x6 ^= ((t << 13) | (t >> 19)) & m
+        t = (x6 + x2) & m
+        x10 ^= ((t << 18) | (t >> 14)) & m
+
+        t = (x15 + x11) & m
+        x3 ^= ((t << 7) | (t >> 25)) & m
+        t = (x3 + x15) & m
+        x7 ^= ((t << 9) | (t >> 23)) & m
+        t = (x7 + x3) & m
+        x11 ^= ((t << 13) | (t >> 19)) & m
+        t = (x11 + x7) & m
+        x15 ^= ((t << 18) | (t >> 14)) & m
+
+        # row round
+        t = (x0 + x3) & m
+        x1 ^= ((t << 7) | (t >> 25)) & m
+        t = (x1 + x0) & m
+        x2 ^= ((t << 9) | (t >> 23)) & m
+        t = (x2 + x1) & m
+        x3 ^= ((t << 13) | (t >> 19)) & m
+        t = (x3 + x2) & m
+        x0 ^= ((t << 18) | (t >> 14)) & m
+
+        t = (x5 + x4) & m
+        x6 ^= ((t << 7) | (t >> 25)) & m
+        t = (x6 + x5) & m
+        x7 ^= ((t << 9) | (t >> 23)) & m
+        t = (x7 + x6) & m
+        x4 ^= ((t << 13) | (t >> 19)) & m
+        t = (x4 + x7) & m
+        x5 ^= ((t << 18) | (t >> 14)) & m
+
+        t = (x10 + x9) & m
+        x11 ^= ((t << 7) | (t >> 25)) & m
+        t = (x11 + x10) & m
+        x8 ^= ((t << 9) | (t >> 23)) & m
+        t = (x8 + x11) & m
+        x9 ^= ((t << 13) | (t >> 19)) & m
+        t = (x9 + x8) & m
+        x10 ^= ((t << 18) | (t >> 14)) & m
+
+        t = (x15 + x14) & m
+        x12 ^= ((t << 7) | (t >> 25)) & m
+        t = (x12 + x15) & m
+        x13 ^= ((t << 9) | (t >> 23)) & m
+        t = (x13 + x12) & m
+        x14 ^= ((t << 13) | (t >> 19)) & m
+        t = (x14 + x13) & m
+        x15 ^= ((t << 18) | (t >> 14)) & m
+
+    return [
+        x0, x1, x2, x3, x4, x5, x6, x7,
+        x8, x9, x10, x11, x12, x13, x14, x15,
+    ]  # fmt: skip
+
+
+def _hsalsa20(key: bytes, nonce: bytes) -> bytes:
+    """
+    Derives the xsalsa20 sub-key from the key and the first 16 bytes of the
+    nonce.
+    """
+    k = struct.unpack("<8I", key)
+    n = struct.unpack("<4I", nonce)
+    x = _salsa20_rounds(
+        [
+            _SIGMA[0], k[0], k[1], k[2],
+            k[3], _SIGMA[1], n[0], n[1],
+            n[2], n[3], _SIGMA[2], k[4],
+            k[5], k[6], k[7], _SIGMA[3],
+        ],  # fmt: skip
+        20,
+    )
+    return struct.pack("<8I", x[0], x[5], x[10], x[15], x[6], x[7], x[8], x[9])
+
+
+def _salsa20_stream(key: bytes, nonce: bytes, length: int) -> bytes:
+    """
+    Generates length bytes of salsa20 key stream for an 8 byte nonce.
+    """
+    k = struct.unpack("<8I", key)
+    n = struct.unpack("<2I", nonce)
+    state = [
+        _SIGMA[0], k[0], k[1], k[2],
+        k[3], _SIGMA[1], n[0], n[1],
+        0, 0, _SIGMA[2], k[4],
+        k[5], k[6], k[7], _SIGMA[3],
+    ]  # fmt: skip
+
+    blocks = []
+    for counter in range((length + 63) // 64):
+        state[8] = counter & _MASK
+        state[9] = counter >> 32
+        x = _salsa20_rounds(state, 20)
+        blocks.append(
+            struct.pack(
+                "<16I", *[(x[i] + state[i]) & _MASK for i in range(16)]
+            )
+        )
+
+    return b"".join(blocks)[:length]
+
+
+# --- Poly1305 ---
+
+_POLY1305_P = (1 << 130) - 5
+_POLY1305_CLAMP = 0x0FFFFFFC0FFFFFFC0FFFFFFC0FFFFFFF
+
+
+def _poly1305(key: bytes, message: bytes) -> bytes:
+    r = int.from_bytes(key[:16], "little") & _POLY1305_CLAMP
+    s = int.from_bytes(key[16:32], "little")
+    p = _POLY1305_P
+    acc = 0
+
+    for block in split_blocks(message, 16):
+        acc = ((acc + int.from_bytes(block + b"\x01", "little")) * r) % p
+
+    return ((acc + s) & ((1 << 128) - 1)).to_bytes(16, "little")
+
+
+# --- AES ---
+
+
+def _build_aes_tables() -> tuple:
+    sbox = [0] * 256
+    p = q = 1
+
+    # Walk the multiplicative group with generator 3 to compute inverses
+    while True:
+        p = p ^ ((p << 1) & 0xFF) ^ (0x1B if p & 0x80 else 0)
+        q ^= q << 1
+        q ^= q << 2
+        q ^= q << 4
+        q &= 0xFF
+        if q & 0x80:
+            q ^= 0x09
+
+        x = q
+        for shift in range(1, 5):
+            x ^= ((q << shift) | (q >> (8 - shift))) & 0xFF
+        sbox[p] = x ^ 0x63
+
+        if p == 1:
+            break
+
+    sbox[0] = 0x63
+
+    inv_sbox = [0] * 256
+    for i, s in enumerate(sbox):
+        inv_sbox[s] = i
+
+    def mul(a, b):
+        result = 0
+        while b:
+            if b & 1:
+                result ^= a
+            a = ((a << 1) ^ (0x1B if a & 0x80 else 0)) & 0xFF
+            b >>= 1
+        return result
+
+    mul_tables = {
+        k: [mul(i, k) for i in range(256)] for k in (2, 3, 9, 11, 13, 14)
+    }
+
+    return sbox, inv_sbox, mul_tables
+
+
+_SBOX, _INV_SBOX, _MUL = _build_aes_tables()
+
+
+def _aes_expand_key(key: bytes) -> list:
+    """
+    Returns the list of round keys, each as a list of 16 byte values.
+    """
+    nk = len(key) // 4
+    if len(key) not in (16, 24, 32):
+        raise ValueError("AES key must be 16, 24 or 32 bytes")
+
+    rounds = nk + 6
+    words = [list(w) for w in split_blocks(key, 4)]
+    rcon = 1
+
+    for i in range(nk, 4 * (rounds + 1)):
+        t = list(words[i - 1])
+        if i % nk == 0:
+            t = [_SBOX[b] for b in t[1:] + t[:1]]
+            t[0] ^= rcon
+            rcon = ((rcon << 1) ^ (0x1B if rcon & 0x80 else 0)) & 0xFF
+        elif nk > 6 and i % nk == 4:
+            t = [_SBOX[b] for b in t]
+        words.append([a ^ b for a, b in zip(words[i - nk], t)])
+
+    return [sum(rk, []) for rk in split_blocks(words, 4)]
+
+
+# ShiftRows as an index permutation over the column-major state
+_SHIFT_ROWS = [(i + 4 * (i % 4)) % 16 for i in range(16)]
+_INV_SHIFT_ROWS = [(i - 4 * (i % 4)) % 16 for i in range(16)]
+
+
+def _aes_encrypt_block(round_keys: list, block: bytes) -> bytes:
+    s = [b ^ k for b, k in zip(block, round_keys[0])]
+    m2, m3 = _MUL[2], _MUL[3]
+
+    for rk in round_keys[1:-1]:
+        s = [_SBOX[s[i]] for i in _SHIFT_ROWS]
+        t = []
+        for a0, a1, a2, a3 in split_blocks(s, 4):
+            t += [
+                m2[a0] ^ m3[a1] ^ a2 ^ a3,
+                a0 ^ m2[a1] ^ m3[a2] ^ a3,
+                a0 ^ a1 ^ m2[a2] ^ m3[a3],
+                m3[a0] ^ a1 ^ a2 ^ m2[a3],
+            ]
+        s = [b ^ k for b, k in zip(t, rk)]
+
+    s = [_SBOX[s[i]] for i in _SHIFT_ROWS]
+    return bytes(b ^ k for b, k in zip(s, round_keys[-1]))
+
+
+def _aes_decrypt_block(round_keys: list, block: bytes) -> bytes:
+    s = [b ^ k for b, k in zip(block, round_keys[-1])]
+    m9, m11, m13, m14 = _MUL[9], _MUL[11], _MUL[13], _MUL[14]
+
+    for rk in reversed(round_keys[1:-1]):
+        s = [_INV_SBOX[s[i]] for i in _INV_SHIFT_ROWS]
+        s = [b ^ k for b, k in zip(s, rk)]
+        t = []
+        for a0, a1, a2, a3 in split_blocks(s, 4):
+            t += [
+                m14[a0] ^ m11[a1] ^ m13[a2] ^ m9[a3],
+                m9[a0] ^ m14[a1] ^ m11[a2] ^ m13[a3],
+                m13[a0] ^ m9[a1] ^ m14[a2] ^ m11[a3],
+                m11[a0] ^ m13[a1] ^ m9[a2] ^ m14[a3],
+            ]
+        s = t
+
+    s = [_INV_SBOX[s[i]] for i in _INV_SHIFT_ROWS]
+    return bytes(b ^ k for b, k in zip(s, round_keys[0]))
+
+
+# --- scrypt ---
+
+
+def _scrypt_block_mix(b: list, r: int) -> list:
+    """
+    scrypt BlockMix over 2 * r blocks of 16 words using salsa20/8.
+    """
+    x = b[-1]
+    y = []
+    for block in b:
+        t = [x[i] ^ block[i] for i in range(16)]
+        z = _salsa20_rounds(t, 8)
+        x = [(z[i] + t[i]) & _MASK for i in range(16)]
+        y.append(x)
+
+    return y[0::2] + y[1::2]
+
+
+def _scrypt(
+    password: bytes, salt: bytes, n: int, r: int, p: int, dklen: int
+) -> bytes:
+    block_size = 128 * r
+    b = hashlib.pbkdf2_hmac("sha256", password, salt, 1, p * block_size)
+
+    mixed = []
+    for chunk in split_blocks(b, block_size):
+        words = struct.unpack(f"<{32 * r}I", chunk)
+        x = split_blocks(list(words), 16)
+
+        v = []
+        for _ in range(n):
+            v.append(x)
+            x = _scrypt_block_mix(x, r)
+
+        for _ in range(n):
+            j = x[-1][0] % n
+            x = _scrypt_block_mix(
+                [[a ^ c for a, c in zip(xb, vb)] for xb, vb in zip(x, v[j])],
+                r,
+            )
+
+        mixed.append(struct.pack(f"<{32 * r}I", *sum(x, [])))
+
+    return hashlib.pbkdf2_hmac("sha256", password, b"".join(mixed), 1, dklen)
+
+
+# --- Backends ---
+
+
+class PythonBackend:
+    """
+    Pure python implementation of the primitives used by rclone crypt. Always
+    available, but slow. The other backends override the primitives their
+    library provides and fall back to these for the rest.
+    """
+
+    name = "python"
+
+    @classmethod
+    def available(cls) -> bool:
+        return True
+
+    def secretbox_seal(self, key: bytes, nonce: bytes, message) -> bytes:
+        message = bytes(message)
+        stream = _salsa20_stream(
+            _hsalsa20(key, nonce[:16]), nonce[16:24], len(message) + 32
+        )
+        ciphertext = _xor(message, stream[32:])
+        return self._poly1305(stream[:32], ciphertext) + ciphertext
+
+    def secretbox_open(self, key: bytes, nonce: bytes, box) -> bytes:
+        """
+        Authenticates and decrypts an xsalsa20-poly1305 box with the 16 byte
+        tag prepended to the ciphertext.
+        """
+        box = bytes(box)
+        if len(box) < 16:
+            raise DecryptionError("secretbox too short")
+
+        tag, ciphertext = box[:16], box[16:]
+        stream = _salsa20_stream(
+            _hsalsa20(key, nonce[:16]), nonce[16:24], len(ciphertext) + 32
+        )
+
+        if not self._poly1305_verify(stream[:32], ciphertext, tag):
+            raise DecryptionError()
+
+        return _xor(ciphertext, stream[32:])
+
+    def secretbox_open_into(self, key: bytes, nonce: bytes, box, out) -> int:
+        """
+        Like secretbox_open, but writes the plaintext into the writable
+        buffer out, which must be at least 16 bytes shorter than box, and
+        returns its length.
+        """
+        plaintext = self.secretbox_open(key, nonce, box)
+        n = len(plaintext)
+        out[:n] = plaintext
+        return n
+
+    def _poly1305(self, key: bytes, message: bytes) -> bytes:
+        return _poly1305(key, message)
+
+    def _poly1305_verify(self, key: bytes, message: bytes, tag: bytes) -> bool:
+        return hmac.compare_digest(self._poly1305(key, message), tag)
+
+    def aes_ecb_encrypt(self, key: bytes, data: bytes) -> bytes:
+        round_keys = _aes_expand_key(key)
+        return b"".join(
+            _aes_encrypt_block(round_keys, block)
+            for block in split_blocks(data, 16)
+        )
+
+    def aes_ecb_decrypt(self, key: bytes, data: bytes) -> bytes:
+        round_keys = _aes_expand_key(key)
+        return b"".join(
+            _aes_decrypt_block(round_keys, block)
+            for block in split_blocks(data, 16)
+        )
+
+    def aes_ctr(self, key: bytes, iv: bytes, data: bytes) -> bytes:
+        """
+        AES in counter mode with a 128 bit big endian counter, as used by
+        go's cipher.NewCTR.
+        """
+        round_keys = _aes_expand_key(key)
+        counter = int.from_bytes(iv, "big")
+        stream = b"".join(
+            _aes_encrypt_block(
+                round_keys,
+                ((counter + i) % (1 << 128)).to_bytes(16, "big"),
+            )
+            for i in range((len(data) + 15) // 16)
+        )
+        return _xor(data, stream[: len(data)])
+
+    def scrypt(
+        self, password: bytes, salt: bytes, n: int, r: int, p: int, dklen: int
+    ) -> bytes:
+        if hasattr(hashlib, "scrypt"):
+            return hashlib.scrypt(
+                password,
+                salt=salt,
+                n=n,
+                r=r,
+                p=p,
+                maxmem=256 * r * (n + p + 1),
+                dklen=dklen,
+            )
+
+        return _scrypt(password, salt, n, r, p, dklen)
+
+
+class CryptographyBackend(PythonBackend):
+    """
+    Uses the cryptography package for AES, poly1305 and scrypt. cryptography
+    has no xsalsa20, so the key stream is still generated in python.
+    """
+
+    name = "cryptography"
+
+    @classmethod
+    def available(cls) -> bool:
+        return cryptography is not None
+
+    def _poly1305(self, key: bytes, message: bytes) -> bytes:
+        return poly1305.Poly1305.generate_tag(key, message)
+
+    def _poly1305_verify(self, key: bytes, message: bytes, tag: bytes) -> bool:
+        try:
+            poly1305.Poly1305.verify_tag(key, message, tag)
+        except InvalidSignature:
+            return False
+        return True
+
+    def aes_ecb_encrypt(self, key: bytes, data: bytes) -> bytes:
+        encryptor = Cipher(algorithms.AES(key), modes.ECB()).encryptor()
+        return encryptor.update(data) + encryptor.finalize()
+
+    def aes_ecb_decrypt(self, key: bytes, data: bytes) -> bytes:
+        decryptor = Cipher(algorithms.AES(key), modes.ECB()).decryptor()
+        return decryptor.update(data) + decryptor.finalize()
+
+    def aes_ctr(self, key: bytes, iv: bytes, data: bytes) -> bytes:
+        decryptor = Cipher(algorithms.AES(key), modes.CTR(iv)).decryptor()
+        return decryptor.update(data) + decryptor.finalize()
+
+    def scrypt(
+        self, password: bytes, salt: bytes, n: int, r: int, p: int, dklen: int
+    ) -> bytes:
+        return Scrypt(salt=salt, length=dklen, n=n, r=r, p=p).derive(password)
+
+
+class NaClBackend(PythonBackend):
+    """
+    Uses libsodium through PyNaCl for xsalsa20-poly1305 and scrypt. libsodium
+    has no raw AES, which is only needed for file names, so that stays in
+    python.
+    """
+
+    name = "nacl"
+
+    @classmethod
+    def available(cls) -> bool:
+        return nacl_bindings is not None
+
+    def secretbox_seal(self, key: bytes, nonce: bytes, message) -> bytes:
+        return nacl_bindings.crypto_secretbox_easy(bytes(message), nonce, key)
+
+    def secretbox_open(self, key: bytes, nonce: bytes, box) -> bytes:
+        try:
+            return nacl_bindings.crypto_secretbox_open_easy(
+                bytes(box), nonce, key
+            )
+        except nacl_exceptions.CryptoError as err:
+            raise DecryptionError() from err
+
+    def secretbox_open_into(self, key: bytes, nonce: bytes, box, out) -> int:
+        if nacl_lib is None:
+            return super().secretbox_open_into(key, nonce, box, out)
+
+        n = len(box) - 16
+        if n < 0 or len(out) < n:
+            raise DecryptionError("secretbox too short")
+
+        # from_buffer passes the memory of box and out to libsodium as is
+        res = nacl_lib.crypto_secretbox_open_easy(
+            nacl_ffi.from_buffer(out, require_writable=True),
+            nacl_ffi.from_buffer(box),
+            len(box),
+            nonce,
+            key,
+        )
+        if res != 0:
+            raise DecryptionError()
+        return n
+
+    def scrypt(
+        self, password: bytes, salt: bytes, n: int, r: int, p: int, dklen: int
+    ) -> bytes:
+        return nacl_bindings.crypto_pwhash_scryptsalsa208sha256_ll(
+            password,
+            salt,
+            n,
+            r,
+            p,
+            dklen=dklen,
+            maxmem=256 * r * (n + p + 1),
+        )
+
+
+backends = {
+    NaClBackend.name: NaClBackend,
+    CryptographyBackend.name: CryptographyBackend,
+    PythonBackend.name: PythonBackend,
+}
+
+backend_choices = ["auto"] + list(backends)
+
+_selected_backend = None
+_backend_instances = {}
+
+
+def available_backends() -> list:
+    """
+    Returns the names of the backends which can be used in this environment.
+    """
+    return [name for name, cls in backends.items() if cls.available()]
+
+
+def benchmark_backend(backend: PythonBackend, box: bytes) -> float:
+    """
+    Returns the throughput of secretbox_open in bytes per second.
+    """
+    key = bytes(32)
+    nonce = bytes(24)
+    iterations = 0
+    start = time.perf_counter()
+
+    while True:
+        backend.secretbox_open(key, nonce, box)
+        iterations += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= BENCHMARK_MIN_SECONDS:
+            break
+
+    return iterations * BENCHMARK_MESSAGE_SIZE / elapsed
+
+
+def _benchmark_cache_key(names: list) -> str:
+    versions = [platform.python_version(), platform.machine()]
+    if "nacl" in names:
+        versions.append(f"nacl-{nacl.__version__}")
+    if "cryptography" in names:
+        versions.append(f"cryptography-{cryptography.__version__}")
+
+    return ",".join(versions)
+
+
+def _read_benchmark_cache(cache_key: str) -> str:
+    try:
+        with open(benchmark_cache_path, "r") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if cached.get("key") != cache_key:
+        return None
+
+    return cached.get("backend")
+
+
+def _write_benchmark_cache(cache_key: str, name: str, results: dict) -> None:
+    try:
+        os.makedirs(default_cache_dir, exist_ok=True)
+        with open(benchmark_cache_path, "w") as f:
+            json.dump(
+                {"key": cache_key, "backend": name, "results": results}, f
+            )
+    except OSError as err:
+        logger.debug(f"Could not write crypto benchmark cache: {err}")
+
+
+def select_fastest_backend() -> str:
+    """
+    Returns the name of the fastest available backend. The result of the
+    micro-benchmark is cached on disk, keyed by the python and library
+    versions.
+    """
+    names = available_backends()
+    if len(names) == 1:
+        return names[0]
+
+    cache_key = _benchmark_cache_key(names)
+    cached_name = _read_benchmark_cache(cache_key)
+    if cached_name in names:
+        logger.debug(f"Using cached crypto backend: {cached_name}")
+        return cached_name
+
+    candidates = [get_backend(name) for name in names]
+    box = candidates[0].secretbox_seal(
+        bytes(32), bytes(24), bytes(BENCHMARK_MESSAGE_SIZE)
+    )
+
+    results = {b.name: benchmark_backend(b, box) for b in candidates}
+    fastest = max(results, key=results.get)
+
+    for name, speed in results.items():
+        logger.debug(f"crypto backend {name}: {speed / 1e6:.1f} MB/s")
+
+    _write_benchmark_cache(cache_key, fastest, results)
+
+    return fastest
+
+
+def get_backend(name: str = "auto") -> PythonBackend:
+    """
+    Returns a crypto backend instance. "auto" selects the fastest one
+    available, any other name must be one of the backends.
+    """
+    global _selected_backend
+
+    if name is None or name == "auto":
+        if _selected_backend is None:
+            _selected_backend = get_backend(select_fastest_backend())
+            logger.info(f"Using crypto backend: {_selected_backend.name}")
+        return _selected_backend
+
+    if name not in backends:
+        raise CryptoBackendError(
+            f"Unknown crypto backend: {name}. "
+            f"Choose from: {', '.join(backend_choices)}"
+        )
+
+    if not backends[name].available():
+        raise CryptoBackendError(
+            f"Crypto backend {name} is not installed. "
+            f"Available backends: {', '.join(available_backends())}"
+        )
+
+    if name not in _backend_instances:
+        _backend_instances[name] = backends[name]()
+
+    return _backend_instances[name]
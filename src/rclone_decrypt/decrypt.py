@@ -1,13 +1,30 @@
+import configparser
+import contextlib
+import itertools
 import logging
+import multiprocessing
 import os
 import re
 import sys
 import shutil
 import tempfile
+import time
 import subprocess
 
 from statemachine import State, StateMachine
 
+import rclone_decrypt.archive as archive
+import rclone_decrypt.chunker as chunker
+import rclone_decrypt.chunks as chunks
+import rclone_decrypt.crypt as crypt
+import rclone_decrypt.crypto as crypto
+import rclone_decrypt.dedup as dedup
+import rclone_decrypt.scan as scan
+import rclone_decrypt.selection as selection
+import rclone_decrypt.tuning as tuning
+import rclone_decrypt.workqueue as workqueue
+import rclone_decrypt.writer as writer
+
 logger = logging.getLogger("rclone_decrypt")
 
 default_output_dir = os.path.join(
@@ -44,6 +61,12 @@ else:
         os.path.expanduser("~"), ".config", "rclone", "rclone.conf"
     )
 
+engine_choices = ["rclone", "native"]
+
+# How long a worker waits before polling a queue whose remaining tasks are
+# all leased by other workers
+worker_poll_seconds = 1.0
+
 
 class ConfigFileError(Exception):
     def __init__(self, *args, **kwargs):
@@ -69,6 +92,18 @@ class RCloneExecutableError(Exception):
         super().__init__(*args, **kwargs)
 
 
+class WorkerError(Exception):
+    def __init__(self, *args, **kwargs):
+        default_message = """A worker process failed before the work queue
+        was finished"""
+
+        if not args:
+            args = (default_message,)
+
+        # Call super constructor
+        super().__init__(*args, **kwargs)
+
+
 def print_error(msg: str) -> None:
     """
     Print generic error.
@@ -93,6 +128,7 @@ class ConfigWriterControl(StateMachine):
     def __init__(self, cfg_file: str) -> None:
         self.cfg_file = cfg_file
         self.cached_entry_start = None
+        self.crypt_remotes = []
 
         super(ConfigWriterControl, self).__init__()
 
@@ -105,16 +141,20 @@ class ConfigWriterControl(StateMachine):
     def before_is_valid(self, line: str) -> None:
         self.cfg_file.write(self.cached_entry_start)
         self.cfg_file.write(line)
+        self.crypt_remotes.append(self.cached_entry_start.strip()[1:-1])
 
 
 def get_rclone_config_path(
-    config: str, files: str, remote_folder_name: str
+    config: str, files: str, remote_folder_name: str, config_dir: str = None
 ) -> str:
     """
     Opens a config file and strips out all of the non-crypt type entries,
-    modifies the remote to be local directory.
+    modifies the remote to be local directory. A chunker remote is added
+    over each crypt remote, see chunker.layer_config, for rclone_copy to
+    copy from so that chunked files are joined.
 
-    Returns the path to the temporary rclone config file.
+    The temporary config file is written to config_dir, which defaults to
+    remote_folder_name. Returns the path to the temporary rclone config file.
     """
     config_path = None
 
@@ -129,7 +169,9 @@ def get_rclone_config_path(
             # passed? Actually, let's create it inside remote_folder_name
             # (which is a temp dir).
 
-            config_path = os.path.join(remote_folder_name, "rclone.conf")
+            if config_dir is None:
+                config_dir = remote_folder_name
+            config_path = os.path.join(config_dir, "rclone.conf")
 
             with open(config_path, "w") as config_out:
                 config_state = ConfigWriterControl(config_out)
@@ -174,6 +216,12 @@ def get_rclone_config_path(
 
                 config_state.complete()
 
+                layers = chunker.layer_config(
+                    config, config_state.crypt_remotes
+                )
+                if layers:
+                    config_out.write(f"\n{layers}")
+
     except FileNotFoundError as err:
         print_error(err)
         return None
@@ -181,10 +229,22 @@ def get_rclone_config_path(
     return config_path
 
 
-def rclone_copy(config_path: str, output_dir: str) -> None:
+def rclone_copy(
+    config_path: str,
+    output_dir: str,
+    files_from: dict = None,
+    flags: dict = None,
+) -> None:
     """
     Calls the rclone copy function via a shell instance and places the
     decrypted files into the output_dir
+
+    files_from optionally maps remotes ("name:") to a file listing the
+    decrypted paths to copy from it. Remotes missing from it are skipped.
+    flags are extra performance flags from tuning.choose_flags.
+
+    Each crypt remote is copied through the chunker remote
+    get_rclone_config_path put over it, when there is one.
     """
     # convert list of remotes in str format into a list
     list_cmd = ["rclone", "--config", config_path, "listremotes"]
@@ -195,24 +255,698 @@ def rclone_copy(config_path: str, output_dir: str) -> None:
         print_error(f"Failed to list remotes: {e}")
         return
 
+    layers = {f"{chunker.layer_name(r[:-1])}:" for r in remotes}
     for r in remotes:
+        if r in layers:
+            continue
+        if files_from is not None and r not in files_from:
+            continue
+
+        source = f"{chunker.layer_name(r[:-1])}:"
+        if source not in remotes:
+            source = r
+
         print(f"Copying and decrypting: {r}")
         copy_cmd = [
             "rclone",
             "--config",
             config_path,
             "copy",
-            f"{r}",
+            f"{source}",
             f"{output_dir}",
         ]
+        if files_from is not None:
+            copy_cmd += ["--files-from-raw", files_from[r]]
+        if flags:
+            copy_cmd += tuning.rclone_args(flags)
         # TODO(@mitchellthompkins): check return code for success
         subprocess.run(copy_cmd, check=True)
 
 
-def decrypt(
+def sample_for_profile(rclone_profile: str, paths) -> tuning.Workload:
+    """
+    Samples the workload of paths if rclone_profile needs it, which only
+    "auto" does, or returns None.
+    """
+    if rclone_profile != "auto":
+        return None
+    return tuning.sample_workload(paths)
+
+
+def tuned_rclone_copy(
+    config_path: str,
+    output_dir: str,
+    workload: tuning.Workload,
+    rclone_profile: str = "auto",
+    files_from: dict = None,
+) -> None:
+    """
+    Calls rclone_copy with the performance flags rclone_profile picks for
+    workload, logging them and the resulting throughput. workload is only
+    needed by the "auto" profile and can be None otherwise, see
+    sample_for_profile.
+    """
+    flags = tuning.choose_flags(rclone_profile, workload)
+    settings = " ".join(tuning.rclone_args(flags)) or "rclone defaults"
+    if workload is None:
+        logger.info(f"Using {settings}")
+    else:
+        logger.info(f"Workload: {workload}. Using {settings}")
+
+    start = time.perf_counter()
+    rclone_copy(config_path, output_dir, files_from, flags)
+    tuning.log_throughput(workload, time.perf_counter() - start)
+
+
+def rclone_copy_files(
+    paths: list, config: str, output_dir: str, rclone_profile: str = "auto"
+) -> bool:
+    """
+    Decrypts the encrypted files at paths into output_dir/<decrypted file
+    name>, like decrypting each of them on its own would, but with one
+    rclone copy per remote and group of files from selection.group_by_root.
+
+    The crypt remotes are pointed at the directories holding the files, so
+    nothing is moved, and rclone is given the decrypted paths to copy with
+    --files-from-raw. The names are decrypted in python, so this returns
+    False without doing anything if a remote uses a name encryption the
+    native engine does not support, so that the caller decrypts the files
+    one by one instead. Files whose names no remote decrypts, such as a
+    stray .DS_Store, are skipped, since rclone would not copy them either.
+
+    rclone_profile picks the rclone performance flags, see tuning.
+    """
+    backend = crypto.get_backend("auto")
+    ciphers = {}
+    try:
+        for name, options in read_crypt_remotes(config).items():
+            ciphers[f"{name}:"] = crypt.Cipher.from_config(options, backend)
+    except crypto.DecryptionError as err:
+        logger.info(f"Decrypting files one by one: {err}")
+        return False
+
+    # (remote, root, decrypted paths) of every rclone copy to run with the
+    # encrypted paths in groups, and (copy, decrypted path) of every file in
+    # the order decrypting them one by one would write them
+    copies = []
+    groups = []
+    order = {}
+    namings = chunker.read_namings(config)
+    for remote, cipher in ciphers.items():
+        readable = []
+        for path in paths:
+            try:
+                cipher.decrypt_file_name(os.path.basename(path))
+                readable.append(path)
+            except crypto.DecryptionError as err:
+                logger.debug(f"{remote} skipping {path}: {err}")
+
+        for root, group in selection.group_by_root(cipher, readable):
+            decrypted = {}
+            for path in group:
+                rel = os.path.relpath(path, root)
+                try:
+                    plain = selection.decrypt_relative_path(cipher, rel)
+                except crypto.DecryptionError as err:
+                    logger.debug(f"{remote} skipping {path}: {err}")
+                    continue
+
+                # rclone copies chunks as the file they are part of
+                decrypted[path] = chunker.composite_path(plain, namings)
+
+            if decrypted:
+                for path, rel in decrypted.items():
+                    if rel is not None:
+                        order[(path, remote)] = (len(copies), rel)
+                    else:
+                        # Chunks of unfinished uploads are never copied
+                        order[(path, remote)] = None
+                rels = [r for r in decrypted.values() if r is not None]
+                copies.append((remote, root, list(dict.fromkeys(rels))))
+                groups.append(list(decrypted))
+
+    for path in paths:
+        if not any((path, remote) in order for remote in ciphers):
+            # rclone would not copy it on its own either
+            logger.debug(f"Skipping {path}: no crypt remote decrypts it")
+
+    moves = [
+        order[(path, remote)]
+        for path in paths
+        for remote in ciphers
+        if order.get((path, remote)) is not None
+    ]
+
+    output_dir = prepare_output_dir(output_dir)
+
+    with tempfile.TemporaryDirectory() as temp_dir_name:
+        # Each copy goes to its own staging dir next to the output, so the
+        # files can be renamed into place
+        with tempfile.TemporaryDirectory(dir=output_dir) as staging:
+            for i, (remote, root, decrypted) in enumerate(copies):
+                config_dir = os.path.join(temp_dir_name, str(i))
+                os.mkdir(config_dir)
+                config_path = get_rclone_config_path(
+                    config, root, root.replace(os.sep, "/"), config_dir
+                )
+                if config_path is None:
+                    raise ConfigFileError("config_path cannot be None")
+
+                files_from = os.path.join(config_dir, "files-from.txt")
+                with open(files_from, "w", encoding="utf-8") as f:
+                    f.writelines(f"{p}\n" for p in decrypted)
+
+                logger.info(f"Decrypting {len(decrypted)} files from: {root}")
+                tuned_rclone_copy(
+                    config_path,
+                    os.path.join(staging, str(i)),
+                    sample_for_profile(rclone_profile, groups[i]),
+                    rclone_profile,
+                    {remote: files_from},
+                )
+
+            for i, path in moves:
+                src = os.path.join(staging, str(i), path)
+                if os.path.isfile(src):
+                    os.replace(
+                        src, os.path.join(output_dir, os.path.basename(src))
+                    )
+
+    return True
+
+
+def native_decrypt_file(
+    cipher: crypt.Cipher,
+    src: str,
+    dst: str,
+    output: writer.OutputWriter = None,
+) -> bool:
+    """
+    Decrypts a single encrypted file to dst with the native engine, keeping
+    the modification time of the source like rclone does. The ciphertext
+    is memory mapped by chunks.ChunkReader and the file is written through
+    output, a writer.OutputWriter, or a default one that leaves fsync to the
+    OS. src can also be a chunker.ChunkedFile, whose parts are joined into
+    dst. Returns False if the file could not be decrypted.
+    """
+    if output is None:
+        output = writer.OutputWriter()
+
+    try:
+        if isinstance(src, chunker.ChunkedFile):
+            st = src.stat()
+            output.write_file(
+                dst,
+                src.decrypted_size(cipher),
+                src.blocks(cipher),
+                (st.st_atime_ns, st.st_mtime_ns),
+            )
+            return True
+
+        with chunks.ChunkReader(src) as reader:
+            st = reader.stat
+            output.write_file(
+                dst,
+                cipher.decrypted_size(st.st_size),
+                chunks.decrypt_chunks(cipher, reader),
+                (st.st_atime_ns, st.st_mtime_ns),
+            )
+    except crypto.DecryptionError as err:
+        print_error(f"Failed to decrypt {src}: {err}")
+        return False
+
+    return True
+
+
+def read_crypt_remotes(config: str) -> dict:
+    """
+    Reads the crypt remotes of the config file, raising ConfigFileError if
+    it cannot be read.
+    """
+    try:
+        return crypt.read_crypt_remotes(config)
+    except (OSError, configparser.Error) as err:
+        raise ConfigFileError(err)
+
+
+def native_plan_path(
+    name: str, cipher: crypt.Cipher, actual_path: str, output_dir: str
+):
+    """
+    Walks a single file or directory with the crypt remote name and yields
+    (remote name, cipher, encrypted path, output path) for each file it can
+    decrypt. Directories are listed concurrently by scan.walk, so files are
+    yielded while the rest of the tree is still being listed.
+    """
+    dir_or_file_name = os.path.basename(actual_path)
+
+    if not os.path.isdir(actual_path):
+        try:
+            out_name = cipher.decrypt_file_name(dir_or_file_name)
+        except crypto.DecryptionError as err:
+            logger.debug(f"{name}: skipping {actual_path}: {err}")
+            return
+
+        yield name, cipher, actual_path, os.path.join(output_dir, out_name)
+        return
+
+    decrypted_dirs = {}
+    try:
+        decrypted_dirs[actual_path] = os.path.join(
+            output_dir, cipher.decrypt_dir_name(dir_or_file_name)
+        )
+    except crypto.DecryptionError as err:
+        logger.debug(f"{name}: skipping {actual_path}: {err}")
+        return
+
+    def descend(entry: os.DirEntry) -> bool:
+        # Prune directories this remote cannot decrypt the names of
+        try:
+            cipher.decrypt_dir_name(entry.name)
+        except crypto.DecryptionError as err:
+            logger.debug(f"{name}: skipping {entry.path}: {err}")
+            return False
+        return True
+
+    for root, dirs, dir_files in scan.walk(actual_path, descend):
+        out_root = decrypted_dirs[root]
+        for d in dirs:
+            decrypted_dirs[d.path] = os.path.join(
+                out_root, cipher.decrypt_dir_name(d.name)
+            )
+
+        for f in dir_files:
+            try:
+                out_name = cipher.decrypt_file_name(f.name)
+            except crypto.DecryptionError as err:
+                logger.debug(f"{name}: skipping {f.name}: {err}")
+                continue
+
+            yield (
+                name,
+                cipher,
+                f.path,
+                os.path.join(out_root, out_name),
+            )
+
+
+def native_plan(files, config: str, output_dir: str, backend):
+    """
+    Walks the files or directories with every crypt remote in the config
+    file and yields (remote name, cipher, encrypted path, output path) for
+    each file that remote can decrypt. Entries whose names cannot be
+    decrypted by a remote are skipped, as rclone does.
+
+    files is a path or a list of paths, each of which ends up where
+    decrypting it on its own would put it. Files split by rclone chunker
+    are yielded once, with a chunker.ChunkedFile of their parts as the
+    encrypted path, whether their chunks are found in a directory or
+    selected one by one. Selected files are yielded after the directories.
+    """
+    paths = [files] if isinstance(files, str) else files
+    namings = chunker.read_namings(config)
+
+    ciphers = {}
+    for name, options in read_crypt_remotes(config).items():
+        print(f"Copying and decrypting: {name}:")
+        try:
+            ciphers[name] = crypt.Cipher.from_config(options, backend)
+        except crypto.DecryptionError as err:
+            print_error(f"Skipping remote {name}: {err}")
+
+    selected_files = []
+    for path in paths:
+        actual_path = os.path.abspath(path)
+        if not os.path.isdir(actual_path):
+            selected_files.append(actual_path)
+            continue
+        for name, cipher in ciphers.items():
+            yield from chunker.group_chunks(
+                native_plan_path(name, cipher, actual_path, output_dir),
+                namings,
+            )
+
+    # The chunks of a file can be selected one by one, so the selected
+    # files are grouped together, by remote and output directory
+    entries = [
+        entry
+        for path in selected_files
+        for name, cipher in ciphers.items()
+        for entry in native_plan_path(name, cipher, path, output_dir)
+    ]
+    entries.sort(key=lambda entry: (entry[0], os.path.dirname(entry[3])))
+    yield from chunker.group_chunks(entries, namings)
+
+
+def link_duplicates(duplicates: dict, method: str, decrypted: set) -> None:
+    """
+    Materializes the duplicates found by dedup.group_duplicates from their
+    primary. Only primaries in decrypted, the outputs written by this job,
+    are linked: one which failed to decrypt may still have a file from an
+    earlier run at its path.
+    """
+    linked = 0
+    for primary, copies in duplicates.items():
+        if primary not in decrypted:
+            continue
+
+        for src, dst in copies:
+            dedup.link_file(primary, dst, method)
+            if not os.path.samefile(primary, dst):
+                st = os.stat(src)
+                os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+            linked += 1
+
+    logger.info(f"Deduplicated {linked} files with {method}s")
+
+
+def native_copy(
+    files: str,
+    config: str,
+    output_dir: str,
+    crypto_backend: str = "auto",
+    dedup_method: str = None,
+    fsync: str = "never",
+) -> None:
+    """
+    Decrypts the files or directories in place with every crypt remote in
+    the config file, without calling rclone. With a dedup_method, files with
+    identical ciphertext are decrypted once and the other outputs are
+    created as hardlinks or reflinks. fsync is passed to the
+    writer.OutputWriter the files are written with.
+    """
+    backend = crypto.get_backend(crypto_backend)
+    plan = native_plan(files, config, output_dir, backend)
+
+    duplicates = {}
+    if dedup_method is not None:
+        plan, duplicates = dedup.group_duplicates(plan)
+
+    decrypted = set()
+    with writer.OutputWriter(fsync) as output:
+        for _, cipher, src, dst in plan:
+            if native_decrypt_file(cipher, src, dst, output):
+                decrypted.add(dst)
+
+    if dedup_method is not None:
+        link_duplicates(duplicates, dedup_method, decrypted)
+
+
+def plaintext_blocks(cipher: crypt.Cipher, src, stack: contextlib.ExitStack):
+    """
+    Returns (size, mtime, blocks) of src, an encrypted path or a
+    chunker.ChunkedFile, where size is computed from the ciphertext and
+    blocks yields the plaintext. The header and first block are decrypted
+    before returning, so a file which is not valid at all raises here
+    rather than once its blocks are being used. Files opened for blocks are
+    closed with stack.
+    """
+    if isinstance(src, chunker.ChunkedFile):
+        size = src.decrypted_size(cipher)
+        mtime = src.stat().st_mtime
+        blocks = src.blocks(cipher)
+    else:
+        reader = stack.enter_context(chunks.ChunkReader(src))
+        size = cipher.decrypted_size(reader.stat.st_size)
+        mtime = reader.stat.st_mtime
+        blocks = chunks.decrypt_chunks(cipher, reader)
+
+    first = next(blocks, None)
+    if first is None:
+        return size, mtime, iter(())
+    return size, mtime, itertools.chain([first], blocks)
+
+
+def archive_copy(
+    files: str,
+    config: str,
+    output_archive: str,
+    crypto_backend: str = "auto",
+) -> None:
+    """
+    Decrypts the files or directories with the native engine straight into
+    a tar or zip archive, without writing them to disk first. The size of
+    each archive member is computed from the ciphertext size.
+
+    Like native_copy, a file whose header or first block fails to decrypt
+    is reported and skipped. Once its member is started a file cannot be
+    left out any more, so if it fails to decrypt further on, the archive is
+    aborted with ArchiveError: it is deleted or, on stdout, left without its
+    end of archive marker, so it is never mistaken for a complete one.
+    """
+    backend = crypto.get_backend(crypto_backend)
+
+    if output_archive == "-":
+        # The archive goes to stdout, so anything printed must not
+        stdout = sys.stdout.buffer
+        redirect = contextlib.redirect_stdout(sys.stderr)
+    else:
+        stdout = None
+        redirect = contextlib.nullcontext()
+
+    with redirect:
+        writer = archive.open_archive(output_archive, stdout)
+        try:
+            for _, cipher, src, name in native_plan(
+                files, config, "", backend
+            ):
+                with contextlib.ExitStack() as stack:
+                    try:
+                        size, mtime, blocks = plaintext_blocks(
+                            cipher, src, stack
+                        )
+                    except (OSError, crypto.DecryptionError) as err:
+                        print_error(f"Failed to decrypt {src}: {err}")
+                        continue
+
+                    try:
+                        stream = archive.open_blocks(blocks)
+                        writer.add(
+                            name.replace(os.sep, "/"), size, mtime, stream
+                        )
+                        # tar stops reading at size, the end of the blocks
+                        # may still have checks to run
+                        if stream.read(1):
+                            raise crypto.DecryptionError(
+                                f"Plaintext is longer than {size} bytes"
+                            )
+                    except (OSError, crypto.DecryptionError) as err:
+                        raise archive.ArchiveError(
+                            f"Failed to add {name} to {output_archive}: {err}"
+                        ) from err
+        except BaseException:
+            writer.abort()
+            if stdout is None:
+                with contextlib.suppress(OSError):
+                    os.remove(output_archive)
+            raise
+
+        writer.close()
+
+
+def run_worker(
+    queue_path: str,
+    config: str,
+    crypto_backend: str = "auto",
+    lease_seconds: float = workqueue.default_lease_seconds,
+    fsync: str = "never",
+) -> int:
+    """
+    Claims files from the work queue and decrypts them with the native
+    engine until every file in the queue is done or has failed. Returns the
+    number of files this worker decrypted.
+
+    A file is acked once it is written. With fsync="batch" it is only
+    renamed into place at the next flush, so a worker that dies may lose
+    acked files that were not flushed yet. Use fsync="file" if the queue
+    must never claim more than is on disk.
+
+    The lease on a file is renewed while it is being decrypted, however
+    long that takes. Queue operations are retried while another process,
+    for example one still adding files, holds the queue's lock.
+    """
+    backend = crypto.get_backend(crypto_backend)
+    remotes = read_crypt_remotes(config)
+    owner = workqueue.worker_id()
+    ciphers = {}
+    done = 0
+
+    queue = workqueue.retry_locked(
+        workqueue.WorkQueue, queue_path, lease_seconds
+    )
+    with queue, writer.OutputWriter(fsync) as output:
+        while True:
+            task = workqueue.retry_locked(queue.claim, owner)
+            if task is None:
+                if workqueue.retry_locked(queue.is_finished):
+                    break
+                # The rest is leased by other workers or not queued yet,
+                # wait in case one of them dies and its lease expires
+                time.sleep(worker_poll_seconds)
+                continue
+
+            task_id, remote, src, dst = task
+            src = chunker.ChunkedFile.loads(src)
+            try:
+                if remote not in ciphers:
+                    ciphers[remote] = crypt.Cipher.from_config(
+                        remotes[remote], backend
+                    )
+                with workqueue.LeaseHeartbeat(
+                    queue_path, task_id, owner, lease_seconds
+                ):
+                    decrypted = native_decrypt_file(
+                        ciphers[remote], src, dst, output
+                    )
+            except (KeyError, OSError, crypto.DecryptionError) as err:
+                error = f"{type(err).__name__}: {err}"
+                workqueue.retry_locked(queue.fail, task_id, owner, error)
+                continue
+
+            if decrypted:
+                acked = workqueue.retry_locked(queue.ack, task_id, owner)
+                if acked:
+                    done += 1
+                else:
+                    logger.warning(f"Lost the lease on {src} before ack")
+            else:
+                # Authentication failures will not go away on a retry
+                workqueue.retry_locked(
+                    queue.fail, task_id, owner, "failed to decrypt", False
+                )
+
+    return done
+
+
+def sharded_copy(
     files: str,
+    config: str,
+    output_dir: str,
+    crypto_backend: str = "auto",
+    workers: int = 0,
+    queue_path: str = None,
+    lease_seconds: float = workqueue.default_lease_seconds,
+    dedup_method: str = None,
+    fsync: str = "never",
+) -> None:
+    """
+    Enumerates the files to decrypt into an SQLite work queue, in batches,
+    while a pool of worker processes decrypts them. If queue_path is on a
+    shared mount, workers on other hosts can join with run_worker. Output paths
+    are stored as absolute paths, so they must be the same on every host.
+    workers=0 starts one worker per CPU. With a dedup_method only one file
+    of each group of duplicates is queued, the rest are linked at the end.
+    Each worker writes its files with its own writer.OutputWriter(fsync).
+
+    Raises WorkerError if a worker exits with an error or files are left
+    pending or leased once every worker is done.
+    """
+    if not workers:
+        workers = os.cpu_count() or 1
+
+    # Fail here rather than in every worker
+    read_crypt_remotes(config)
+
+    # Resolve "auto" once so the workers don't all benchmark
+    backend = crypto.get_backend(crypto_backend)
+
+    with tempfile.TemporaryDirectory() as temp_dir_name:
+        if queue_path is None:
+            queue_path = os.path.join(temp_dir_name, "queue.sqlite")
+
+        plan = native_plan(files, config, output_dir, backend)
+        duplicates = {}
+        if dedup_method is not None:
+            plan, duplicates = dedup.group_duplicates(plan)
+
+        def queued():
+            for name, _, src, dst in plan:
+                # Chunked files are queued with their parts as JSON
+                if isinstance(src, chunker.ChunkedFile):
+                    src = src.dumps()
+                yield name, src, dst
+
+        processes = [
+            multiprocessing.Process(
+                target=run_worker,
+                args=(
+                    queue_path,
+                    config,
+                    backend.name,
+                    lease_seconds,
+                    fsync,
+                ),
+            )
+            for _ in range(workers)
+        ]
+        # Workers start on the first batches while the tree is still being
+        # enumerated into the queue
+        with workqueue.WorkQueue(queue_path, lease_seconds) as queue:
+            queue.start_enqueuing()
+            try:
+                for p in processes:
+                    p.start()
+                added = queue.put(queued())
+            finally:
+                queue.finish_enqueuing()
+        logger.info(f"Queued {added} files for {workers} workers")
+
+        for p in processes:
+            p.join()
+        crashed = [p.exitcode for p in processes if p.exitcode != 0]
+
+        with workqueue.WorkQueue(queue_path, lease_seconds) as queue:
+            for src, error in queue.failed():
+                src = chunker.ChunkedFile.loads(src)
+                print_error(f"Failed to decrypt {src}: {error}")
+            counts = queue.counts()
+            logger.info(f"Work queue: {counts}")
+            decrypted = set(queue.done())
+
+        if dedup_method is not None:
+            link_duplicates(duplicates, dedup_method, decrypted)
+
+    unfinished = counts.get("pending", 0) + counts.get("leased", 0)
+    if crashed or unfinished:
+        raise WorkerError(
+            f"{len(crashed)} of {workers} workers failed, exit codes: "
+            f"{crashed}. {unfinished} files were not decrypted"
+        )
+
+
+def prepare_output_dir(output_dir: str) -> str:
+    """
+    Resolves the default output directory and creates it if needed.
+    """
+    if output_dir is default_output_dir:
+        # If no output_dir is provided, put the de-crypted file into a
+        # folder called 'out' that lives in the current working
+        # directory
+        output_dir = os.path.abspath(default_output_dir)
+        logger.info(
+            f"No output directory specified. Defaulting to: {output_dir}"
+        )
+
+    # if the output folder doesn't exist, make it
+    if not os.path.isdir(output_dir):
+        logger.info(f"Creating output directory: {output_dir}")
+        os.makedirs(output_dir, exist_ok=True)
+
+    return output_dir
+
+
+def decrypt(
+    files,
     config: str = default_rclone_conf_dir,
     output_dir: str = default_output_dir,
+    engine: str = "rclone",
+    crypto_backend: str = "auto",
+    workers: int = 1,
+    queue: str = None,
+    output_archive: str = None,
+    dedup_method: str = None,
+    fsync: str = "never",
+    rclone_profile: str = "auto",
 ) -> None:
     """
     Sets up the files or directories to be decrypted by moving them to the
@@ -226,10 +960,141 @@ def decrypt(
     folder in _this_ directory, calls `rclone --config config file copy
     remote:local_tmp_dir out` and then moves the files back to their original
     location.
+
+    files can also be a list of paths, for example a selection made in the
+    GUI. It is collapsed into as few jobs as possible by
+    selection.plan_jobs, each file still ending up in
+    output_dir/<decrypted file name> as if it was decrypted on its own: the
+    rclone engine copies all the selected files under their common parent
+    directory with one rclone copy per remote, and the native engine
+    decrypts the whole selection as one job.
+
+    With engine="native" the files are decrypted in place by python using
+    crypto_backend ("auto" picks the fastest one installed) and rclone is
+    not needed. With more than one worker, or a queue file, the files are
+    split between worker processes through an SQLite work queue.
+
+    Files split by an rclone chunker remote over a crypt remote are joined
+    back together by both engines: rclone copies through a chunker remote
+    added over each crypt remote of the temporary config, and the native
+    engine groups the chunks with chunker.group_chunks. A crypt remote over
+    a chunker remote is not supported, its chunks are left as they are.
+
+    If output_archive is given the native engine streams the decrypted files
+    into that tar or zip archive ("-" for a tar on stdout) instead of
+    output_dir.
+
+    dedup_method ("hardlink" or "reflink") makes the native engine decrypt
+    files with identical ciphertext only once and link the other outputs.
+
+    fsync controls how the native engine flushes the files it writes:
+    "file" fsyncs each one, "batch" fsyncs them in groups and "never"
+    leaves it to the OS.
+
+    rclone_profile picks the rclone engine's --transfers, --checkers,
+    --buffer-size and multi-thread flags: "auto" derives them from a sample
+    of the input's file sizes and the CPU count, "small-files" and
+    "large-files" force those settings and "default" keeps rclone's.
     """
+    if engine not in engine_choices:
+        raise ValueError(f"engine must be one of: {', '.join(engine_choices)}")
+
+    sharded = workers != 1 or queue is not None
+    if sharded and engine != "native":
+        raise ValueError("workers and queue require the native engine")
+
+    if dedup_method is not None:
+        if dedup_method not in dedup.dedup_choices:
+            choices = ", ".join(dedup.dedup_choices)
+            raise ValueError(f"dedup_method must be one of: {choices}")
+        if engine != "native" or output_archive is not None:
+            raise ValueError("dedup requires the native engine and output_dir")
+
+    if rclone_profile not in tuning.profile_choices:
+        choices = ", ".join(tuning.profile_choices)
+        raise ValueError(f"rclone_profile must be one of: {choices}")
+    if rclone_profile != "auto" and engine != "rclone":
+        raise ValueError("rclone_profile requires the rclone engine")
+
+    if fsync not in writer.fsync_choices:
+        choices = ", ".join(writer.fsync_choices)
+        raise ValueError(f"fsync must be one of: {choices}")
+
+    if not isinstance(files, str):
+        jobs = selection.plan_jobs(files)
+        files = []
+        for root, names in jobs:
+            if names is None:
+                files.append(root)
+            else:
+                files += [os.path.join(root, n) for n in names]
+
+    if output_archive is not None:
+        if engine != "native":
+            raise ValueError("output_archive requires the native engine")
+        if sharded:
+            raise ValueError("output_archive cannot be used with workers")
+
+        try:
+            archive_copy(files, config, output_archive, crypto_backend)
+            logger.info(f"Decryption complete. Archive: {output_archive}")
+        except ConfigFileError as err:
+            print_error(err)
+        return
+
+    if engine == "native":
+        try:
+            output_dir = prepare_output_dir(output_dir)
+            if isinstance(files, str):
+                logger.info(f"Decrypting: {os.path.abspath(files)}")
+            else:
+                logger.info(f"Decrypting {len(files)} selected paths")
+            if sharded:
+                sharded_copy(
+                    files,
+                    config,
+                    output_dir,
+                    crypto_backend,
+                    workers,
+                    queue,
+                    dedup_method=dedup_method,
+                    fsync=fsync,
+                )
+            else:
+                native_copy(
+                    files,
+                    config,
+                    output_dir,
+                    crypto_backend,
+                    dedup_method,
+                    fsync,
+                )
+            logger.info(f"Decryption complete. Files saved to: {output_dir}")
+        except (ConfigFileError, WorkerError) as err:
+            print_error(err)
+        return
+
     if shutil.which("rclone") is None:
         raise RCloneExecutableError()
 
+    if not isinstance(files, str):
+        for root, names in jobs:
+            if names is None:
+                decrypt(
+                    root, config, output_dir, rclone_profile=rclone_profile
+                )
+                continue
+
+            paths = [os.path.join(root, n) for n in names]
+            if not rclone_copy_files(
+                paths, config, output_dir, rclone_profile
+            ):
+                for path in paths:
+                    decrypt(
+                        path, config, output_dir, rclone_profile=rclone_profile
+                    )
+        return
+
     actual_path = os.path.abspath(files)
 
     try:
@@ -250,24 +1115,14 @@ def decrypt(
             if config_path is None:
                 raise ConfigFileError("config_path cannot be None")
 
-            if output_dir is default_output_dir:
-                # If no output_dir is provided, put the de-crypted file into a
-                # folder called 'out' that lives in the current working
-                # directory
-                output_dir = os.path.abspath(default_output_dir)
-                logger.info(
-                    "No output directory specified. "
-                    f"Defaulting to: {output_dir}"
-                )
-
-            # if the output folder doesn't exist, make it
-            if not os.path.isdir(output_dir):
-                logger.info(f"Creating output directory: {output_dir}")
-                os.makedirs(output_dir, exist_ok=True)
+            output_dir = prepare_output_dir(output_dir)
 
             dir_or_file_name = os.path.basename(actual_path)
             temp_file_path = os.path.join(temp_dir_name, dir_or_file_name)
 
+            # Sample the input before it is moved, to tune rclone for it
+            workload = sample_for_profile(rclone_profile, actual_path)
+
             # Move the folder
             logger.info(f"Decrypting: {actual_path}")
             shutil.move(actual_path, temp_file_path)
@@ -276,7 +1131,9 @@ def decrypt(
                 # Do the copy, we wrap this in a try in case the user
                 # interrupts the process, otherwise the file won't be
                 # moved back
-                rclone_copy(config_path, output_dir)
+                tuned_rclone_copy(
+                    config_path, output_dir, workload, rclone_profile
+                )
                 logger.info(
                     f"Decryption complete. Files saved to: {output_dir}"
                 )
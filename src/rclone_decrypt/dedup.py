@@ -0,0 +1,106 @@
+import errno
+import hashlib
+import logging
+import os
+import shutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import rclone_decrypt.crypt as crypt
+
+logger = logging.getLogger("rclone_decrypt")
+
+dedup_choices = ["hardlink", "reflink"]
+
+# ioctl request of linux FICLONE, _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+
+def fingerprint(path: str) -> tuple:
+    """
+    Cheap fingerprint of an encrypted file: its size, and a hash of the
+    header, which holds the random nonce, plus the first block. rclone picks
+    a new nonce whenever it encrypts a file, so two files only share one if
+    they are copies of the same encrypted object.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        head = f.read(crypt.FILE_HEADER_SIZE + crypt.BLOCK_SIZE)
+
+    return size, hashlib.sha256(head).digest()
+
+
+def group_duplicates(plan) -> tuple:
+    """
+    Splits the (remote, cipher, src, dst) entries of a native plan into the
+    entries that need decrypting and a dict mapping the dst of each of
+    those to the (src, dst) of its duplicates.
+    """
+    primaries = []
+    by_fingerprint = {}
+    duplicates = {}
+
+    for entry in plan:
+        name, _, src, dst = entry
+        if not isinstance(src, str):
+            # Files joined from chunks are never deduplicated
+            primaries.append(entry)
+            continue
+
+        try:
+            key = (name,) + fingerprint(src)
+        except OSError as err:
+            logger.debug(f"Could not fingerprint {src}: {err}")
+            primaries.append(entry)
+            continue
+
+        if key in by_fingerprint:
+            duplicates[by_fingerprint[key]].append((src, dst))
+        else:
+            by_fingerprint[key] = dst
+            duplicates[dst] = []
+            primaries.append(entry)
+
+    return primaries, {k: v for k, v in duplicates.items() if v}
+
+
+def reflink(src: str, dst: str) -> None:
+    """
+    Clones src to dst sharing the same extents, on filesystems which support
+    it (btrfs, xfs, ...).
+    """
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "reflinks are not supported")
+
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        try:
+            fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+        except OSError:
+            fout.close()
+            os.remove(dst)
+            raise
+
+
+def link_file(src: str, dst: str, method: str) -> None:
+    """
+    Materializes dst as a copy of the already decrypted src using a
+    hardlink or reflink, falling back to a regular copy if the output
+    filesystem does not support it.
+    """
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    try:
+        if method == "hardlink":
+            os.link(src, dst)
+        else:
+            reflink(src, dst)
+        return
+    except OSError as err:
+        logger.debug(f"Could not {method} {dst}, copying: {err}")
+
+    shutil.copyfile(src, dst)
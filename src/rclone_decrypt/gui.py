@@ -23,6 +23,7 @@ from flet import (
 )
 
 import rclone_decrypt.decrypt as decrypt
+import rclone_decrypt.scan as scan
 
 # Configure logging
 # We will use a custom handler, so basicConfig here might be redundant if we
@@ -165,11 +166,11 @@ def start_gui(debug: bool = False):
         def add_folder_result(e: FilePickerResultEvent):
             if e.path:
                 # Walk the directory and add all files
-                for root, dirs, files in os.walk(e.path):
-                    for file in files:
-                        full_path = os.path.join(root, file)
-                        if full_path not in files_to_decrypt:
-                            files_to_decrypt.append(full_path)
+                known = set(files_to_decrypt)
+                for entry in scan.iter_files(e.path):
+                    if entry.path not in known:
+                        known.add(entry.path)
+                        files_to_decrypt.append(entry.path)
                 update_files_list()
 
         add_folder_picker = FilePicker(on_result=add_folder_result)
@@ -296,16 +297,18 @@ def start_gui(debug: bool = False):
                     page.update()
                     return
 
+                selected = []
                 for f in files_to_decrypt:
                     clean_path = f.strip("\"'")
                     # Verify file exists
                     if not os.path.exists(clean_path):
                         print(f"Skipping missing file: {clean_path}")
                         continue
+                    selected.append(clean_path)
 
-                    decrypt.decrypt(
-                        clean_path, config_file_path, output_dir_path
-                    )
+                # Decrypt the whole selection at once so it is coalesced
+                # into as few rclone jobs as possible
+                decrypt.decrypt(selected, config_file_path, output_dir_path)
 
                 status_text.value = "Decryption Complete!"
                 status_text.color = colors.GREEN
@@ -0,0 +1,113 @@
+import concurrent.futures
+import logging
+import os
+import queue
+import threading
+
+logger = logging.getLogger("rclone_decrypt")
+
+# Listing directories waits on the filesystem, not the CPU, so use more
+# threads than CPUs like concurrent.futures does
+default_threads = min(32, (os.cpu_count() or 1) + 4)
+
+# Scanned directories waiting to be consumed, bounds memory when the
+# consumer is slower than the scan
+max_pending_dirs = 1024
+
+_put_poll_seconds = 0.1
+
+
+def walk(top: str, descend=None, threads: int = default_threads):
+    """
+    Walks the directory tree under top like os.walk, yielding (path, dirs,
+    files) where dirs and files are lists of os.DirEntry, so the file type
+    and, where the OS returns it with the listing, the stat result come for
+    free.
+
+    Directories are listed concurrently by a pool of threads and yielded as
+    soon as they are listed, so callers can start working on the first files
+    while the rest of the tree is still being listed. A directory is always
+    yielded before its subdirectories, otherwise the order is undefined.
+
+    descend is called from the pool with the os.DirEntry of each
+    subdirectory and decides whether it is walked, like removing it from
+    dirs in os.walk. Symlinks to directories are listed in dirs but not
+    walked. Directories which cannot be listed are skipped.
+    """
+    results = queue.Queue(max_pending_dirs)
+    stop = threading.Event()
+
+    def put(item) -> None:
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=_put_poll_seconds)
+                return
+            except queue.Full:
+                continue
+
+    def scan(path: str) -> None:
+        try:
+            with os.scandir(path) as it:
+                entries = list(it)
+        except OSError as err:
+            logger.debug(f"Could not list {path}: {err}")
+            put((path, None, None, [], None))
+            return
+
+        try:
+            dirs = []
+            files = []
+            for entry in entries:
+                if _is_dir(entry):
+                    if descend is None or descend(entry):
+                        dirs.append(entry)
+                else:
+                    files.append(entry)
+            children = [d.path for d in dirs if not _is_symlink(d)]
+        except Exception as err:
+            put((path, None, None, [], err))
+            return
+
+        # Queued before the children are submitted, so it is yielded first
+        put((path, dirs, files, children, None))
+        for child in children:
+            if stop.is_set():
+                break
+            pool.submit(scan, child)
+
+    pool = concurrent.futures.ThreadPoolExecutor(threads)
+    try:
+        pool.submit(scan, top)
+        outstanding = 1
+        while outstanding:
+            path, dirs, files, children, error = results.get()
+            outstanding += len(children) - 1
+            if error is not None:
+                raise error
+            if dirs is not None:
+                yield path, dirs, files
+    finally:
+        stop.set()
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def iter_files(top: str, threads: int = default_threads):
+    """
+    Yields the os.DirEntry of every file under the directory top, see walk.
+    """
+    for _, _, files in walk(top, threads=threads):
+        yield from files
+
+
+def _is_dir(entry: os.DirEntry) -> bool:
+    try:
+        return entry.is_dir()
+    except OSError:
+        return False
+
+
+def _is_symlink(entry: os.DirEntry) -> bool:
+    try:
+        return entry.is_symlink()
+    except OSError:
+        return True
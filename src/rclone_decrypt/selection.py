@@ -0,0 +1,108 @@
+import logging
+import os
+
+import rclone_decrypt.crypt as crypt
+import rclone_decrypt.crypto as crypto
+
+logger = logging.getLogger("rclone_decrypt")
+
+
+def plan_jobs(paths) -> list:
+    """
+    Collapses a selection of files and directories into as few decryption
+    jobs as possible, returned as (root, names) tuples in selection order.
+
+    A selected directory is its own job with names None, decrypted into
+    output_dir/<decrypted directory name> as before. Selected files are
+    decrypted into output_dir/<decrypted file name> whatever directory they
+    came from, so they can share one job: root is the deepest directory
+    holding all of them and names are their paths relative to it, in
+    selection order. Files on different Windows drives get a job per drive.
+    Missing and repeated paths are dropped.
+    """
+    jobs = []
+    file_jobs = {}
+    seen = set()
+
+    for path in paths:
+        path = os.path.abspath(path)
+        if path in seen:
+            continue
+        seen.add(path)
+
+        if os.path.isdir(path):
+            jobs.append((path, None))
+        elif os.path.exists(path):
+            drive = os.path.splitdrive(path)[0]
+            if drive not in file_jobs:
+                file_jobs[drive] = []
+                jobs.append((drive, file_jobs[drive]))
+            file_jobs[drive].append(path)
+        else:
+            logger.info(f"Skipping missing file: {path}")
+
+    planned = []
+    for root, names in jobs:
+        if names is None:
+            planned.append((root, None))
+            continue
+
+        root = os.path.commonpath([os.path.dirname(n) for n in names])
+        planned.append((root, [os.path.relpath(n, root) for n in names]))
+
+    return planned
+
+
+def decrypt_relative_path(cipher: crypt.Cipher, path: str) -> str:
+    """
+    Decrypts every segment of a relative path of an encrypted file, using
+    forward slashes like rclone. Raises crypto.DecryptionError if any of
+    them cannot be decrypted.
+    """
+    parts = path.split(os.sep)
+    dirs = [cipher.decrypt_dir_name(d) for d in parts[:-1]]
+    return "/".join(dirs + [cipher.decrypt_file_name(parts[-1])])
+
+
+def group_by_root(cipher: crypt.Cipher, paths: list) -> list:
+    """
+    Groups the encrypted files at paths under as few directories as
+    possible that a crypt remote using cipher could be rooted at to reach
+    them, returned as (root, [paths]) tuples. Every directory between a
+    root and its files must decrypt with cipher, so a root is at most as
+    high as the top of the encrypted tree the files are in, and at least
+    their parent directory.
+    """
+    # Highest possible root for the files of each directory
+    tops = {}
+
+    def top(d: str) -> str:
+        if d not in tops:
+            parent, name = os.path.split(d)
+            tops[d] = d
+            if name:
+                try:
+                    cipher.decrypt_dir_name(name)
+                except crypto.DecryptionError:
+                    pass
+                else:
+                    tops[d] = top(parent)
+        return tops[d]
+
+    # [root, length of its deepest top, paths]
+    groups = []
+    for path in paths:
+        parent = os.path.dirname(path)
+        limit = len(top(parent))
+
+        for group in reversed(groups):
+            root = os.path.commonpath([group[0], parent])
+            if len(root) >= max(group[1], limit):
+                group[0] = root
+                group[1] = max(group[1], limit)
+                group[2].append(path)
+                break
+        else:
+            groups.append([parent, limit, [path]])
+
+    return [(root, group_paths) for root, _, group_paths in groups]
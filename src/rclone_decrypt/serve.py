@@ -0,0 +1,465 @@
+import collections
+import configparser
+import email.utils
+import html
+import http.server
+import logging
+import mimetypes
+import os
+import re
+import threading
+import urllib.parse
+
+import rclone_decrypt.crypt as crypt
+import rclone_decrypt.crypto as crypto
+
+logger = logging.getLogger("rclone_decrypt")
+
+default_host = "127.0.0.1"
+default_port = 8080
+default_cache_size = 64 * 1024 * 1024
+default_name_cache_dirs = 4096
+
+range_regex = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class ServeError(Exception):
+    def __init__(self, *args, **kwargs):
+        default_message = "None of the crypt remotes can decrypt the root"
+
+        if not args:
+            args = (default_message,)
+
+        # Call super constructor
+        super().__init__(*args, **kwargs)
+
+
+class ChunkCache:
+    """
+    Thread safe LRU cache of decrypted blocks, bounded by their total size.
+    """
+
+    def __init__(self, max_bytes: int = default_cache_size) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.blocks = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            block = self.blocks.get(key)
+            if block is not None:
+                self.blocks.move_to_end(key)
+            return block
+
+    def put(self, key, block: bytes) -> None:
+        if len(block) > self.max_bytes:
+            return
+
+        with self.lock:
+            old = self.blocks.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+
+            self.blocks[key] = block
+            self.size += len(block)
+            while self.size > self.max_bytes:
+                _, evicted = self.blocks.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class DecryptedTree:
+    """
+    Read only plaintext view of a directory of rclone crypt files.
+
+    Plaintext paths are resolved one segment at a time against the
+    decrypted listing of each encrypted directory. Listings are cached,
+    keyed by the directory's mtime so changes are picked up, and decrypted
+    blocks are kept in a ChunkCache. Both caches are shared by every
+    request.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        cipher: crypt.Cipher,
+        cache_size: int = default_cache_size,
+        name_cache_dirs: int = default_name_cache_dirs,
+    ) -> None:
+        self.root = os.path.abspath(root)
+        self.cipher = cipher
+        self.chunks = ChunkCache(cache_size)
+        self.name_cache_dirs = name_cache_dirs
+        self.listings = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def listing(self, path: str) -> dict:
+        """
+        Returns {plaintext name: (encrypted path, is dir)} for the
+        encrypted directory path, skipping names that do not decrypt.
+        """
+        mtime = os.stat(path).st_mtime_ns
+        with self.lock:
+            cached = self.listings.get(path)
+            if cached is not None and cached[0] == mtime:
+                self.listings.move_to_end(path)
+                return cached[1]
+
+        entries = {}
+        with os.scandir(path) as it:
+            for entry in it:
+                is_dir = entry.is_dir()
+                try:
+                    if is_dir:
+                        name = self.cipher.decrypt_dir_name(entry.name)
+                    else:
+                        name = self.cipher.decrypt_file_name(entry.name)
+                except crypto.DecryptionError:
+                    continue
+                entries[name] = (entry.path, is_dir)
+
+        with self.lock:
+            self.listings[path] = (mtime, entries)
+            self.listings.move_to_end(path)
+            while len(self.listings) > self.name_cache_dirs:
+                self.listings.popitem(last=False)
+
+        return entries
+
+    def resolve(self, plain_path: str) -> tuple:
+        """
+        Maps a "/" separated plaintext path to (encrypted path, is dir).
+        Raises FileNotFoundError if it does not exist.
+        """
+        path, is_dir = self.root, True
+        for segment in plain_path.split("/"):
+            if not segment:
+                continue
+            if segment in (".", "..") or not is_dir:
+                raise FileNotFoundError(plain_path)
+
+            entry = self.listing(path).get(segment)
+            if entry is None:
+                raise FileNotFoundError(plain_path)
+            path, is_dir = entry
+
+        return path, is_dir
+
+    def read_block(self, fin, st: os.stat_result, nonce: bytes, i: int):
+        """
+        Returns the plaintext of block i of the open encrypted file fin.
+        """
+        key = (fin.name, st.st_ino, st.st_mtime_ns, st.st_size, i)
+        block = self.chunks.get(key)
+        if block is None:
+            fin.seek(crypt.FILE_HEADER_SIZE + i * crypt.BLOCK_SIZE)
+            data = fin.read(crypt.BLOCK_SIZE)
+            if len(data) <= crypt.BLOCK_HEADER_SIZE:
+                raise crypto.DecryptionError("File has a truncated block")
+
+            block = self.cipher.decrypt_block(
+                self.cipher.nonce_add(nonce, i), data
+            )
+            self.chunks.put(key, block)
+        return block
+
+    def read_range(
+        self, fin, st: os.stat_result, nonce: bytes, start: int, end: int
+    ):
+        """
+        Yields the plaintext of the encrypted file fin, whose header holds
+        nonce, from start up to but not including end, decrypting only the
+        blocks the range touches.
+        """
+        first = start // crypt.BLOCK_DATA_SIZE
+        last = (end - 1) // crypt.BLOCK_DATA_SIZE
+        for i in range(first, last + 1):
+            block = self.read_block(fin, st, nonce, i)
+            block_start = i * crypt.BLOCK_DATA_SIZE
+            lo = max(start - block_start, 0)
+            hi = min(end - block_start, len(block))
+            yield block[lo:hi]
+
+
+def parse_range(header: str, size: int):
+    """
+    Parses a single "bytes=" Range header into (start, end) with end
+    exclusive. Returns None to serve the whole file, as for multiple ranges,
+    and raises ValueError if the range cannot be satisfied.
+    """
+    match = range_regex.match(header.strip())
+    if match is None or size == 0:
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+
+    if not first:
+        # Suffix range, the last n bytes
+        n = int(last)
+        if n == 0:
+            raise ValueError(header)
+        return max(size - n, 0), size
+
+    start = int(first)
+    end = min(int(last) + 1, size) if last else size
+    if start >= size or end <= start:
+        raise ValueError(header)
+    return start, end
+
+
+class DecryptedRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves a DecryptedTree, set as the server's tree attribute.
+    """
+
+    server_version = "rclone-decrypt"
+
+    def do_HEAD(self) -> None:
+        self.send_path(head=True)
+
+    def do_GET(self) -> None:
+        self.send_path(head=False)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def send_path(self, head: bool) -> None:
+        tree = self.server.tree
+        plain_path = urllib.parse.unquote(
+            urllib.parse.urlsplit(self.path).path
+        )
+
+        try:
+            path, is_dir = tree.resolve(plain_path)
+        except (FileNotFoundError, NotADirectoryError):
+            self.send_error(404)
+            return
+
+        if is_dir:
+            if not plain_path.endswith("/"):
+                self.send_response(301)
+                self.send_header("Location", self.path + "/")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_listing(tree, path, plain_path, head)
+            return
+
+        try:
+            with open(path, "rb") as fin:
+                self.send_file(tree, fin, plain_path, head)
+        except crypto.DecryptionError as err:
+            logger.error(f"Failed to decrypt {path}: {err}")
+            self.send_error(500)
+        except (BrokenPipeError, ConnectionResetError):
+            logger.debug(f"Client went away while sending {path}")
+
+    def send_file(self, tree: DecryptedTree, fin, plain_path, head) -> None:
+        st = os.fstat(fin.fileno())
+        size = tree.cipher.decrypted_size(st.st_size)
+
+        start, end = 0, size
+        status = 200
+        header = self.headers.get("Range")
+        if header is not None:
+            try:
+                requested = parse_range(header, size)
+            except ValueError:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if requested is not None:
+                start, end = requested
+                status = 206
+
+        # Check the header before committing to a response
+        nonce = tree.cipher.read_header(fin.read(crypt.FILE_HEADER_SIZE))
+
+        content_type = mimetypes.guess_type(plain_path)[0]
+        if content_type is None:
+            content_type = "application/octet-stream"
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(end - start))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header(
+            "Last-Modified", email.utils.formatdate(st.st_mtime, usegmt=True)
+        )
+        if status == 206:
+            content_range = f"bytes {start}-{end - 1}/{size}"
+            self.send_header("Content-Range", content_range)
+        self.end_headers()
+
+        if head or start == end:
+            return
+
+        try:
+            for data in tree.read_range(fin, st, nonce, start, end):
+                self.wfile.write(data)
+        except crypto.DecryptionError as err:
+            # The status is out already, cutting the response short is all
+            # that can signal the failure
+            logger.error(f"Failed to decrypt {fin.name}: {err}")
+            self.close_connection = True
+
+    def send_listing(self, tree, path: str, plain_path: str, head) -> None:
+        entries = sorted(tree.listing(path).items())
+        title = html.escape(plain_path)
+        lines = [
+            "<!DOCTYPE html>",
+            f"<html><head><title>{title}</title></head><body>",
+            f"<h1>{title}</h1><ul>",
+        ]
+        for name, (_, is_dir) in entries:
+            name = name + "/" if is_dir else name
+            href = urllib.parse.quote(name)
+            text = html.escape(name)
+            lines.append(f'<li><a href="{href}">{text}</a></li>')
+        lines.append("</ul></body></html>")
+        body = "\n".join(lines).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+
+def _sample_names(root: str) -> list:
+    """
+    Returns (name, is_dir) for the entries of root and of its
+    subdirectories, so that a root holding only directories with
+    unencrypted names still has file names to try. Subdirectories which
+    cannot be listed are skipped.
+    """
+    with os.scandir(root) as it:
+        entries = [(e.path, e.name, e.is_dir()) for e in it]
+
+    names = [(name, is_dir) for _, name, is_dir in entries]
+    for path, _, is_dir in entries:
+        if not is_dir:
+            continue
+        try:
+            with os.scandir(path) as it:
+                names.extend((e.name, e.is_dir()) for e in it)
+        except OSError as err:
+            logger.debug(f"Could not list {path}: {err}")
+    return names
+
+
+def pick_cipher(
+    root: str, config: str, remote: str = None, backend=None
+) -> crypt.Cipher:
+    """
+    Returns the cipher of the crypt remote named remote or, by default, of
+    the remote that decrypts the most names in root and its
+    subdirectories. Names a remote leaves unchanged, like directories
+    without directory name encryption, do not count. If no remote decrypts
+    any name, the first remote of the config that can be used is picked.
+    """
+    try:
+        remotes = crypt.read_crypt_remotes(config)
+    except (OSError, configparser.Error) as err:
+        raise ServeError(f"Could not read {config}: {err}") from err
+
+    if remote is not None:
+        if remote not in remotes:
+            raise ServeError(f"No crypt remote named {remote} in {config}")
+        return crypt.Cipher.from_config(remotes[remote], backend)
+
+    entries = _sample_names(root)
+
+    first, first_name = None, None
+    best, best_name, best_count = None, None, 0
+    for name, options in remotes.items():
+        try:
+            cipher = crypt.Cipher.from_config(options, backend)
+        except crypto.DecryptionError as err:
+            logger.debug(f"Skipping remote {name}: {err}")
+            continue
+
+        if first is None:
+            first, first_name = cipher, name
+
+        count = 0
+        for n, is_dir in entries:
+            try:
+                if is_dir:
+                    decrypted = cipher.decrypt_dir_name(n)
+                else:
+                    decrypted = cipher.decrypt_file_name(n)
+            except crypto.DecryptionError:
+                continue
+            count += decrypted != n
+
+        if count > best_count:
+            best, best_name, best_count = cipher, name, count
+
+    if best is None:
+        if first is None:
+            raise ServeError(f"No usable crypt remote in {config}")
+        logger.warning(
+            f"No crypt remote decrypts the names in {root}, "
+            f"using the first one: {first_name}"
+        )
+        best, best_name = first, first_name
+
+    logger.info(f"Serving with crypt remote: {best_name}")
+    return best
+
+
+def make_server(
+    root: str,
+    cipher: crypt.Cipher,
+    host: str = default_host,
+    port: int = default_port,
+    cache_size: int = default_cache_size,
+) -> http.server.ThreadingHTTPServer:
+    """
+    Creates a threaded HTTP server for the plaintext view of root. Call
+    serve_forever() on it to start serving.
+    """
+    server = http.server.ThreadingHTTPServer(
+        (host, port), DecryptedRequestHandler
+    )
+    server.daemon_threads = True
+    server.tree = DecryptedTree(root, cipher, cache_size)
+    return server
+
+
+def serve(
+    root: str,
+    config: str,
+    host: str = default_host,
+    port: int = default_port,
+    remote: str = None,
+    crypto_backend: str = "auto",
+    cache_size: int = default_cache_size,
+) -> None:
+    """
+    Serves the decrypted names and contents of the encrypted directory root
+    over HTTP until interrupted. Files are decrypted on demand, block by
+    block, and Range requests only decrypt the blocks they touch.
+    """
+    if not os.path.isdir(root):
+        raise ServeError(f"{root} is not a directory")
+
+    backend = crypto.get_backend(crypto_backend)
+    cipher = pick_cipher(root, config, remote, backend)
+    server = make_server(root, cipher, host, port, cache_size)
+
+    address = server.server_address
+    logger.info(f"Serving {root} on http://{address[0]}:{address[1]}/")
+    print(f"Serving {root} on http://{address[0]}:{address[1]}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,230 @@
+import logging
+import os
+import random
+import time
+
+import rclone_decrypt.scan as scan
+
+logger = logging.getLogger("rclone_decrypt")
+
+profile_choices = ["auto", "default", "small-files", "large-files"]
+
+# At most this many files are stat'ed to estimate the size distribution
+default_sample_size = 10000
+
+# Counting stops after this many files or seconds, so sampling a huge tree
+# does not cost a full listing before rclone even starts
+default_max_files = 100000
+default_time_budget = 5.0
+
+small_file_size = 1024 * 1024
+large_file_size = 64 * 1024 * 1024
+
+max_transfers = 64
+
+
+class Workload:
+    """
+    Shape of a decryption job: its number of files and a sample of their
+    encrypted sizes. If complete is False, counting was cut short and count
+    is a lower bound.
+    """
+
+    def __init__(self, count: int, sizes: list, complete: bool = True) -> None:
+        self.count = count
+        self.sizes = sorted(sizes)
+        self.complete = complete
+
+    @property
+    def total_bytes(self) -> int:
+        """
+        Total size of the job, extrapolated from the sample.
+        """
+        if not self.sizes:
+            return 0
+        return sum(self.sizes) * self.count // len(self.sizes)
+
+    @property
+    def median(self) -> int:
+        if not self.sizes:
+            return 0
+        return self.sizes[len(self.sizes) // 2]
+
+    @property
+    def large_fraction(self) -> float:
+        """
+        Fraction of the bytes held by files of at least large_file_size.
+        """
+        total = sum(self.sizes)
+        if not total:
+            return 0.0
+        return sum(s for s in self.sizes if s >= large_file_size) / total
+
+    def __str__(self) -> str:
+        at_least = "" if self.complete else "at least "
+        return (
+            f"{at_least}{self.count} files, "
+            f"~{self.total_bytes / 1024**2:.1f}MiB, "
+            f"median {self.median / 1024:.1f}KiB"
+        )
+
+
+def sample_workload(
+    paths,
+    sample_size: int = default_sample_size,
+    max_files: int = default_max_files,
+    time_budget: float = default_time_budget,
+):
+    """
+    Walks the files and directories in paths with scan.iter_files, counting
+    the files and stat'ing a uniform random sample of at most sample_size
+    of them. The walk stops after max_files files or time_budget seconds,
+    in which case the sample only covers the files counted so far.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+
+    rng = random.Random(0)
+    count = 0
+    sample = []
+    deadline = time.monotonic() + time_budget
+
+    def add(path: str) -> None:
+        nonlocal count
+        count += 1
+        if len(sample) < sample_size:
+            sample.append(path)
+        else:
+            # Reservoir sampling keeps every file equally likely
+            i = rng.randrange(count)
+            if i < sample_size:
+                sample[i] = path
+
+    def exhausted() -> bool:
+        return count >= max_files or time.monotonic() >= deadline
+
+    complete = True
+    for path in paths:
+        if exhausted():
+            complete = False
+            break
+        if os.path.isdir(path):
+            for entry in scan.iter_files(path):
+                add(entry)
+                if exhausted():
+                    complete = False
+                    break
+        elif os.path.exists(path):
+            add(path)
+
+    sizes = []
+    for item in sample:
+        try:
+            if isinstance(item, os.DirEntry):
+                # Cached from the directory listing where the OS has it
+                sizes.append(item.stat().st_size)
+            else:
+                sizes.append(os.stat(item).st_size)
+        except OSError as err:
+            logger.debug(f"Could not stat {item}: {err}")
+
+    if not complete:
+        logger.debug(f"Stopped counting files to decrypt at {count}")
+    return Workload(count, sizes, complete)
+
+
+def small_files_flags(cpus: int) -> dict:
+    # Each tiny file is mostly open/close and metadata latency, so run many
+    # at once and keep the per transfer read buffer small
+    transfers = min(max_transfers, cpus * 4)
+    return {
+        "--transfers": transfers,
+        "--checkers": transfers * 2,
+        "--buffer-size": "1M",
+    }
+
+
+def large_files_flags(cpus: int) -> dict:
+    # A few big files are decrypted fastest by splitting each of them
+    # between streams, one per CPU
+    return {
+        "--transfers": max(2, cpus // 2),
+        "--checkers": 8,
+        "--buffer-size": "32M",
+        "--multi-thread-streams": max(2, cpus),
+        "--multi-thread-cutoff": "64M",
+    }
+
+
+def choose_flags(
+    profile: str = "auto", workload: Workload = None, cpus: int = None
+) -> dict:
+    """
+    Returns the rclone copy performance flags for profile as a dict of flag
+    to value. "default" leaves rclone's defaults alone, "small-files" and
+    "large-files" tune for those regardless of the input, and "auto" picks
+    between them from the workload.
+    """
+    if profile not in profile_choices:
+        choices = ", ".join(profile_choices)
+        raise ValueError(f"rclone_profile must be one of: {choices}")
+
+    if cpus is None:
+        cpus = os.cpu_count() or 1
+
+    if profile == "default":
+        return {}
+    if profile == "small-files":
+        return small_files_flags(cpus)
+    if profile == "large-files":
+        return large_files_flags(cpus)
+
+    if workload is None or not workload.count:
+        return {}
+
+    if workload.large_fraction >= 0.5:
+        flags = large_files_flags(cpus)
+    elif workload.median < small_file_size:
+        flags = small_files_flags(cpus)
+    else:
+        transfers = min(max_transfers, cpus * 2)
+        flags = {"--transfers": transfers, "--checkers": transfers * 2}
+
+    # More transfers than files only costs memory
+    flags["--transfers"] = max(1, min(flags["--transfers"], workload.count))
+    return flags
+
+
+def rclone_args(flags: dict) -> list:
+    """
+    Turns a dict from choose_flags into rclone command line arguments.
+    """
+    args = []
+    for flag, value in flags.items():
+        args += [flag, str(value)]
+    return args
+
+
+def log_throughput(workload: Workload, seconds: float) -> None:
+    """
+    Logs how long the copy of workload took and, if its size is known, the
+    throughput. An incomplete workload only gives lower bounds, so its
+    throughput is not logged.
+    """
+    if workload is None:
+        logger.info(f"rclone copy took {seconds:.2f}s")
+        return
+
+    mib = workload.total_bytes / 1024**2
+    if not workload.complete:
+        logger.info(
+            f"Decrypted at least {workload.count} files, at least "
+            f"~{mib:.1f}MiB in {seconds:.2f}s"
+        )
+        return
+
+    rate = mib / seconds if seconds > 0 else 0.0
+    logger.info(
+        f"Decrypted {workload.count} files, ~{mib:.1f}MiB in {seconds:.2f}s "
+        f"({rate:.1f}MiB/s)"
+    )
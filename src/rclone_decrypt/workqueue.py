@@ -0,0 +1,333 @@
+import itertools
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger("rclone_decrypt")
+
+default_lease_seconds = 600
+default_max_attempts = 3
+
+# Tasks added per transaction, so workers can claim while a job is queued
+default_batch_size = 256
+
+# How long to wait before retrying when another process holds the lock
+locked_retry_seconds = 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    remote TEXT NOT NULL,
+    src TEXT NOT NULL,
+    dst TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    UNIQUE (remote, src, dst)
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, lease_expires);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value REAL
+);
+"""
+
+
+def worker_id() -> str:
+    """
+    Identifies a worker process across hosts sharing a queue file.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def is_locked(err: sqlite3.OperationalError) -> bool:
+    """
+    Whether err means another connection held the lock for longer than the
+    busy timeout, so the operation can be retried.
+    """
+    message = str(err).lower()
+    return "locked" in message or "busy" in message
+
+
+def retry_locked(fn, *args):
+    """
+    Calls fn(*args), retrying for as long as the queue file is locked.
+    """
+    while True:
+        try:
+            return fn(*args)
+        except sqlite3.OperationalError as err:
+            if not is_locked(err):
+                raise
+            logger.debug(f"Work queue is locked, retrying: {err}")
+            time.sleep(locked_retry_seconds)
+
+
+class WorkQueue:
+    """
+    A work queue of files to decrypt stored in an SQLite file, so that
+    worker processes, or workers on several hosts sharing the file over a
+    mount, can split up a single job.
+
+    Workers claim a task by taking a lease on it, and renew the lease while
+    they work on it. A task whose lease expires, because its worker crashed
+    or was killed, goes back to the queue and is retried up to max_attempts
+    times. Only the worker holding the lease can ack or fail a task.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        lease_seconds: float = default_lease_seconds,
+        max_attempts: int = default_max_attempts,
+    ) -> None:
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        # isolation_level=None so that transactions are explicit, claims
+        # take the write lock up front with BEGIN IMMEDIATE
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __enter__(self) -> "WorkQueue":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def put(self, tasks, batch_size: int = default_batch_size) -> int:
+        """
+        Adds (remote, src, dst) tuples to the queue, committing every
+        batch_size of them so workers can claim the first tasks while the
+        rest are being generated. Tasks already in the queue are left
+        alone, so a job can be re-enqueued after a crash. Returns the number
+        of tasks added.
+        """
+        added = 0
+        tasks = iter(tasks)
+        while True:
+            batch = list(itertools.islice(tasks, batch_size))
+            if not batch:
+                break
+
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self.db.executemany(
+                    "INSERT OR IGNORE INTO tasks (remote, src, dst) "
+                    "VALUES (?, ?, ?)",
+                    batch,
+                )
+                added += cursor.rowcount
+                # Keep workers waiting for the rest while batches come in
+                self.db.execute(
+                    "UPDATE meta SET value = ? "
+                    "WHERE key = 'enqueuing_until' AND value IS NOT NULL",
+                    (time.time() + self.lease_seconds,),
+                )
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+
+        return added
+
+    def _set_enqueuing(self, until) -> None:
+        self.db.execute(
+            "INSERT OR REPLACE INTO meta (key, value) "
+            "VALUES ('enqueuing_until', ?)",
+            (until,),
+        )
+
+    def start_enqueuing(self) -> None:
+        """
+        Tells workers more tasks are coming, so they wait for them instead
+        of exiting when the queue is empty. Every batch put extends this
+        by lease_seconds, in case the process adding them dies.
+        """
+        self._set_enqueuing(time.time() + self.lease_seconds)
+
+    def finish_enqueuing(self) -> None:
+        self._set_enqueuing(None)
+
+    def is_enqueuing(self) -> bool:
+        row = self.db.execute(
+            "SELECT value FROM meta WHERE key = 'enqueuing_until'"
+        ).fetchone()
+        return row is not None and row[0] is not None and row[0] > time.time()
+
+    def claim(self, owner: str) -> tuple:
+        """
+        Leases the next pending or expired task to owner and returns it as
+        (id, remote, src, dst), or None if there is nothing to claim right
+        now.
+        """
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            # Expired leases which have used up their attempts have failed
+            self.db.execute(
+                "UPDATE tasks SET state = 'failed', "
+                "error = 'lease expired' "
+                "WHERE state = 'leased' AND lease_expires < ? "
+                "AND attempts >= ?",
+                (now, self.max_attempts),
+            )
+            row = self.db.execute(
+                "SELECT id, remote, src, dst FROM tasks "
+                "WHERE state = 'pending' "
+                "OR (state = 'leased' AND lease_expires < ?) "
+                "ORDER BY id LIMIT 1",
+                (now,),
+            ).fetchone()
+
+            if row is not None:
+                self.db.execute(
+                    "UPDATE tasks SET state = 'leased', owner = ?, "
+                    "lease_expires = ?, attempts = attempts + 1 "
+                    "WHERE id = ?",
+                    (owner, now + self.lease_seconds, row[0]),
+                )
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+
+        return row
+
+    def renew(self, task_id: int, owner: str) -> bool:
+        """
+        Extends owner's lease on a claimed task by lease_seconds. Returns
+        False if owner no longer holds the lease.
+        """
+        cursor = self.db.execute(
+            "UPDATE tasks SET lease_expires = ? "
+            "WHERE id = ? AND owner = ? AND state = 'leased'",
+            (time.time() + self.lease_seconds, task_id, owner),
+        )
+        return cursor.rowcount > 0
+
+    def ack(self, task_id: int, owner: str) -> bool:
+        """
+        Marks a task claimed by owner as done. Returns False, leaving the
+        task alone, if owner no longer holds its lease.
+        """
+        cursor = self.db.execute(
+            "UPDATE tasks SET state = 'done', owner = NULL, "
+            "lease_expires = NULL "
+            "WHERE id = ? AND owner = ? AND state = 'leased'",
+            (task_id, owner),
+        )
+        return cursor.rowcount > 0
+
+    def fail(
+        self, task_id: int, owner: str, error: str, retry: bool = True
+    ) -> bool:
+        """
+        Returns a task claimed by owner to the queue, or marks it as failed
+        once it has used up its attempts or if it is not worth retrying.
+        Returns False, leaving the task alone, if owner no longer holds its
+        lease.
+        """
+        max_attempts = self.max_attempts if retry else 0
+        cursor = self.db.execute(
+            "UPDATE tasks SET owner = NULL, lease_expires = NULL, error = ?, "
+            "state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END "
+            "WHERE id = ? AND owner = ? AND state = 'leased'",
+            (error, max_attempts, task_id, owner),
+        )
+        return cursor.rowcount > 0
+
+    def counts(self) -> dict:
+        """
+        Returns the number of tasks in each state.
+        """
+        rows = self.db.execute(
+            "SELECT state, COUNT(*) FROM tasks GROUP BY state"
+        ).fetchall()
+        return dict(rows)
+
+    def failed(self) -> list:
+        """
+        Returns (src, error) of every failed task.
+        """
+        return self.db.execute(
+            "SELECT src, error FROM tasks WHERE state = 'failed'"
+        ).fetchall()
+
+    def done(self) -> list:
+        """
+        Returns the dst of every task which was acked.
+        """
+        rows = self.db.execute("SELECT dst FROM tasks WHERE state = 'done'")
+        return [dst for dst, in rows]
+
+    def is_finished(self) -> bool:
+        """
+        True once no task is pending or leased and no more are being added.
+        """
+        counts = self.counts()
+        return (
+            not counts.get("pending", 0)
+            and not counts.get("leased", 0)
+            and not self.is_enqueuing()
+        )
+
+
+class LeaseHeartbeat:
+    """
+    Renews owner's lease on a task from a background thread, with its own
+    connection to the queue file, for as long as the context is entered.
+    Without it a file that takes longer than the lease to decrypt would be
+    handed to another worker while it is still being decrypted.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        task_id: int,
+        owner: str,
+        lease_seconds: float = default_lease_seconds,
+    ) -> None:
+        self.path = path
+        self.task_id = task_id
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def __enter__(self) -> "LeaseHeartbeat":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self) -> None:
+        interval = self.lease_seconds / 3
+        queue = None
+        try:
+            while not self.stopped.wait(interval):
+                try:
+                    if queue is None:
+                        queue = WorkQueue(self.path, self.lease_seconds)
+                    if not queue.renew(self.task_id, self.owner):
+                        logger.warning(
+                            f"Lost the lease on task {self.task_id}"
+                        )
+                        return
+                except sqlite3.OperationalError as err:
+                    # Try again at the next beat, the lease has time left
+                    logger.debug(f"Could not renew lease: {err}")
+        finally:
+            if queue is not None:
+                queue.close()
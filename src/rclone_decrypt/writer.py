@@ -0,0 +1,196 @@
+import logging
+import os
+
+logger = logging.getLogger("rclone_decrypt")
+
+fsync_choices = ["file", "batch", "never"]
+
+default_buffer_size = 1024 * 1024
+default_batch_files = 256
+default_batch_bytes = 256 * 1024 * 1024
+
+
+def fsync_path(path: str) -> None:
+    """
+    fsyncs a file or directory by path. Directories cannot be opened on
+    Windows, where the rename is durable once the file is, so that is
+    skipped.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError as err:
+        logger.debug(f"Could not open {path} to fsync: {err}")
+        return
+
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_all(f, data) -> None:
+    """
+    Writes all of data to the unbuffered file f, which may accept only part
+    of it in one call.
+    """
+    view = memoryview(data)
+    while view:
+        n = f.write(view)
+        view = view[n:]
+
+
+class OutputWriter:
+    """
+    Writes decrypted files to the output directory.
+
+    Each file is written to a temporary name next to its destination,
+    preallocated to its known plaintext size, filled with large writes from
+    a reused buffer and renamed over the destination once it is complete,
+    so a destination file is never left half written.
+
+    fsync decides what is flushed to disk before the rename: "file" fsyncs
+    every file before renaming it, "batch" keeps finished files under their
+    temporary names until batch_files files or batch_bytes bytes are
+    pending, then fsyncs them all before renaming them, and "never" leaves
+    flushing to the OS. Either way, after a crash a destination file holds
+    either its old contents or all of its new ones.
+    """
+
+    def __init__(
+        self,
+        fsync: str = "never",
+        buffer_size: int = default_buffer_size,
+        batch_files: int = default_batch_files,
+        batch_bytes: int = default_batch_bytes,
+    ) -> None:
+        if fsync not in fsync_choices:
+            choices = ", ".join(fsync_choices)
+            raise ValueError(f"fsync must be one of: {choices}")
+
+        self.fsync = fsync
+        self.buffer = bytearray(buffer_size)
+        self.batch_files = batch_files
+        self.batch_bytes = batch_bytes
+        # dst: temporary path of the files waiting for the next flush
+        self.pending_files = {}
+        self.pending_bytes = 0
+
+    def __enter__(self) -> "OutputWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    @staticmethod
+    def temp_path(dst: str) -> str:
+        return f"{dst}.{os.getpid()}.partial"
+
+    def write_file(self, dst: str, size: int, chunks, mtime_ns=None) -> int:
+        """
+        Writes the byte chunks from the iterable chunks to dst. size is the
+        expected total size, used to preallocate the file. If iterating the
+        chunks raises, the temporary file is removed and dst is left alone.
+        With fsync="batch", dst only appears at the next flush. Returns the
+        number of bytes written.
+        """
+        if dst in self.pending_files:
+            # Its temporary file is about to be written again
+            self.flush()
+
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        temp = self.temp_path(dst)
+        written = 0
+
+        try:
+            with open(temp, "wb", buffering=0) as f:
+                fd = f.fileno()
+                # Files which fit in the buffer go out in a single write,
+                # which allocates them in one go anyway
+                if size > len(self.buffer) and hasattr(os, "posix_fallocate"):
+                    try:
+                        os.posix_fallocate(fd, 0, size)
+                    except OSError as err:
+                        logger.debug(f"Could not preallocate {dst}: {err}")
+
+                written = self._write_chunks(f, chunks)
+                if written != size:
+                    f.truncate(written)
+
+                if self.fsync == "file":
+                    os.fsync(fd)
+
+            if mtime_ns is not None:
+                os.utime(temp, ns=mtime_ns)
+            if self.fsync != "batch":
+                os.replace(temp, dst)
+        except BaseException:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+
+        if self.fsync == "file":
+            fsync_path(os.path.dirname(dst))
+        elif self.fsync == "batch":
+            self.pending_files[dst] = temp
+            self.pending_bytes += written
+            if (
+                len(self.pending_files) >= self.batch_files
+                or self.pending_bytes >= self.batch_bytes
+            ):
+                self.flush()
+
+        return written
+
+    def _write_chunks(self, f, chunks) -> int:
+        """
+        Coalesces the chunks into buffer sized writes.
+        """
+        buffer = self.buffer
+        view = memoryview(buffer)
+        capacity = len(buffer)
+        filled = 0
+        written = 0
+
+        for chunk in chunks:
+            n = len(chunk)
+            if filled + n > capacity:
+                write_all(f, view[:filled])
+                written += filled
+                filled = 0
+
+            if n >= capacity:
+                write_all(f, chunk)
+                written += n
+                continue
+
+            end = filled + n
+            buffer[filled:end] = chunk
+            filled = end
+
+        if filled:
+            write_all(f, view[:filled])
+            written += filled
+
+        return written
+
+    def flush(self) -> None:
+        """
+        fsyncs every file written since the last flush, renames them into
+        place and fsyncs their directories.
+        """
+        pending = self.pending_files
+        self.pending_files = {}
+        self.pending_bytes = 0
+
+        for temp in pending.values():
+            fsync_path(temp)
+
+        dirs = set()
+        for dst, temp in pending.items():
+            os.replace(temp, dst)
+            dirs.add(os.path.dirname(dst))
+        for d in dirs:
+            fsync_path(d)
+
+    def close(self) -> None:
+        self.flush()
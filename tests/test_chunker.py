@@ -0,0 +1,114 @@
+from rclone_decrypt import chunker
+from rclone_decrypt import crypt
+from rclone_decrypt import decrypt
+
+import os
+import shutil
+import tempfile
+
+decrypt_rclone_config_file = os.path.join("tests", "rclone_decrypt.conf")
+test_dir = "tests"
+
+
+def test_default_naming():
+    naming = chunker.ChunkNaming()
+
+    assert naming.parse("a.txt.rclone_chunk.001") == ("a.txt", 0)
+    assert naming.parse("a.txt.rclone_chunk.1234") == ("a.txt", 1233)
+    assert naming.parse("a.txt.rclone_chunk.01") is None
+    assert naming.parse("a.txt") is None
+
+    assert naming.parse("a.txt.rclone_chunk.001_x1y2") is None
+    assert naming.is_hidden("a.txt.rclone_chunk.001_x1y2")
+    assert naming.is_hidden("a.txt.rclone_chunk._lock")
+    assert not naming.is_hidden("a.txt.rclone_chunk.001")
+
+
+def test_read_namings():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config = os.path.join(temp_dir, "rclone.conf")
+        with open(config, "w") as f:
+            f.write(
+                "[parts]\n"
+                "type = chunker\n"
+                "remote = secret:\n"
+                "name_format = *.part#\n"
+                "start_from = 0\n"
+            )
+
+        namings = chunker.read_namings(config)
+
+    assert [n.name_format for n in namings] == [
+        "*.part#",
+        chunker.default_name_format,
+    ]
+    assert namings[0].parse("a.txt.part12") == ("a.txt", 12)
+
+
+def test_chunked_file_serialization():
+    chunked = chunker.ChunkedFile(["/a.001", "/a.002"], {"ver": 1})
+    loaded = chunker.ChunkedFile.loads(chunked.dumps())
+
+    assert loaded.parts == chunked.parts
+    assert loaded.meta == chunked.meta
+    assert chunker.ChunkedFile.loads("/a.001") == "/a.001"
+
+
+def test_layer_config():
+    """
+    Test that the chunker put over a crypt remote reads chunks the way the
+    config's own chunker over it named them
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config = os.path.join(temp_dir, "rclone.conf")
+        with open(config, "w") as f:
+            f.write(
+                "[parts]\n"
+                "type = chunker\n"
+                "remote = secret:backups\n"
+                "name_format = *.part#\n"
+                "chunk_size = 1G\n"
+            )
+
+        layers = chunker.layer_config(config, ["secret", "other"])
+
+    assert layers == (
+        "[secret_rclone_decrypt_chunker]\n"
+        "type = chunker\n"
+        "remote = secret:\n"
+        "name_format = *.part#\n"
+        "\n"
+        "[other_rclone_decrypt_chunker]\n"
+        "type = chunker\n"
+        "remote = other:\n"
+    )
+
+
+def test_missing_chunk():
+    """
+    Test that a chunked file missing one of its chunks is not written
+    """
+    options = crypt.read_crypt_remotes(decrypt_rclone_config_file)["crypt1"]
+    cipher = crypt.Cipher.from_config(options)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        files = os.path.join(temp_dir, "chunked_files")
+        shutil.copytree(os.path.join(test_dir, "chunked_files"), files)
+
+        sub_folder = os.path.join(files, "sub_folder")
+        for name in os.listdir(sub_folder):
+            plain = cipher.decrypt_file_name(name)
+            if plain == "file1.txt.rclone_chunk.002":
+                os.remove(os.path.join(sub_folder, name))
+
+        out_dir = os.path.join(temp_dir, "out")
+        decrypt.decrypt(
+            files, decrypt_rclone_config_file, out_dir, engine="native"
+        )
+
+        out_sub_folder = os.path.join(out_dir, "chunked_files", "sub_folder")
+        assert sorted(os.listdir(out_sub_folder)) == [
+            "file0.txt",
+            "file2.txt",
+            "file3.txt",
+        ]
@@ -0,0 +1,73 @@
+from rclone_decrypt import chunks
+from rclone_decrypt import crypt
+from rclone_decrypt import crypto
+
+import mmap
+import os
+import pytest
+import tempfile
+
+decrypt_rclone_config_file = os.path.join("tests", "rclone_decrypt.conf")
+test_dir = "tests"
+
+
+@pytest.fixture(params=crypto.available_backends())
+def cipher(request):
+    remotes = crypt.read_crypt_remotes(decrypt_rclone_config_file)
+    return crypt.Cipher.from_config(
+        remotes["crypt0"], crypto.get_backend(request.param)
+    )
+
+
+def decrypt_path(cipher: crypt.Cipher, path: str) -> tuple:
+    with chunks.ChunkReader(path) as reader:
+        data = b"".join(
+            bytes(b) for b in chunks.decrypt_chunks(cipher, reader)
+        )
+        return data, reader.mapped
+
+
+def test_mapped_matches_read(cipher):
+    """
+    Test that the mapped reader decrypts like reading the file does
+    """
+    path = os.path.join(test_dir, "encrypted_files0", "file4.txt.bin")
+    with open(path, "rb") as fin:
+        expected = b"".join(cipher.decrypt_blocks(fin))
+
+    data, mapped = decrypt_path(cipher, path)
+    assert mapped is True
+    assert data == expected
+
+
+def test_unmappable_file(cipher, monkeypatch):
+    """
+    Test that files which cannot be mapped are read into a buffer instead
+    """
+    path = os.path.join(test_dir, "encrypted_files0", "file4.txt.bin")
+    expected, _ = decrypt_path(cipher, path)
+
+    def fail(*args, **kwargs):
+        raise OSError("no mmap here")
+
+    monkeypatch.setattr(mmap, "mmap", fail)
+    data, mapped = decrypt_path(cipher, path)
+    assert mapped is False
+    assert data == expected
+
+
+def test_truncated_file(cipher):
+    """
+    Test that a block cut short after its header is rejected
+    """
+    path = os.path.join(test_dir, "encrypted_files0", "file4.txt.bin")
+    with open(path, "rb") as f:
+        header = f.read(crypt.FILE_HEADER_SIZE + crypt.BLOCK_HEADER_SIZE)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        truncated = os.path.join(temp_dir, "truncated.bin")
+        with open(truncated, "wb") as f:
+            f.write(header)
+
+        with pytest.raises(crypto.DecryptionError):
+            decrypt_path(cipher, truncated)
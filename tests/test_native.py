@@ -0,0 +1,385 @@
+from rclone_decrypt import archive
+from rclone_decrypt import chunks
+from rclone_decrypt import crypt
+from rclone_decrypt import crypto
+from rclone_decrypt import decrypt
+from tests.test_rclone_decrypt import compare_files, smart_cmp
+
+import os
+import pytest
+import shutil
+import tarfile
+import tempfile
+import zipfile
+
+decrypt_rclone_config_file = os.path.join("tests", "rclone_decrypt.conf")
+test_dir = "tests"
+
+
+@pytest.fixture(params=crypto.available_backends())
+def backend_name(request):
+    return request.param
+
+
+@pytest.mark.parametrize(
+    "encrypted_folder, decrypted_folder",
+    [
+        ("encrypted_files0", "encrypted_files0"),
+        ("encrypted_files1", "encrypted_files1"),
+        (
+            "0f12hh28evsof1kgflv67ldcngbgfa8j4viad0q5ie7mj1n1m490",
+            "encrypted_files2",
+        ),
+    ],
+)
+def test_native_engine(backend_name, encrypted_folder, decrypted_folder):
+    """
+    Test that the native engine decrypts file names, folder names and
+    contents with every available crypto backend
+    """
+    files = os.path.join(test_dir, encrypted_folder)
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        decrypt.decrypt(
+            files,
+            decrypt_rclone_config_file,
+            out_dir,
+            engine="native",
+            crypto_backend=backend_name,
+        )
+
+        assert compare_files(decrypted_folder, out_dir) is True
+
+
+def test_native_individual_file():
+    """
+    Test that individually specified files are decrypted natively
+    """
+    encrypted_file_path = os.path.join(
+        test_dir, "encrypted_files0", "sub_folder", "file2.txt.bin"
+    )
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        decrypt.decrypt(
+            encrypted_file_path,
+            decrypt_rclone_config_file,
+            out_dir,
+            engine="native",
+        )
+
+        assert smart_cmp(
+            os.path.join(test_dir, "raw_files", "sub_folder", "file2.txt"),
+            os.path.join(out_dir, "file2.txt"),
+        )
+
+
+def test_backends_agree(backend_name):
+    """
+    Test that every backend produces the same results as the pure python one
+    """
+    reference = crypto.get_backend("python")
+    backend = crypto.get_backend(backend_name)
+    key = bytes(range(32))
+    nonce = bytes(range(24))
+    message = os.urandom(1000)
+
+    box = reference.secretbox_seal(key, nonce, message)
+    assert backend.secretbox_seal(key, nonce, message) == box
+    assert backend.secretbox_open(key, nonce, box) == message
+
+    with pytest.raises(crypto.DecryptionError):
+        backend.secretbox_open(key, nonce, box[:-1] + b"\x00")
+
+    data = os.urandom(48)
+    assert (
+        backend.aes_ecb_decrypt(key, reference.aes_ecb_encrypt(key, data))
+        == data
+    )
+    assert backend.aes_ctr(key, nonce[:16], data) == reference.aes_ctr(
+        key, nonce[:16], data
+    )
+    assert backend.scrypt(b"pw", b"salt", 1024, 8, 1, 80) == reference.scrypt(
+        b"pw", b"salt", 1024, 8, 1, 80
+    )
+
+
+def test_unknown_backend():
+    with pytest.raises(crypto.CryptoBackendError):
+        crypto.get_backend("not_a_backend")
+
+
+def test_unsupported_filename_encoding():
+    with pytest.raises(crypto.DecryptionError):
+        crypt.Cipher(b"password", filename_encoding="base32768")
+
+
+def test_decrypted_size():
+    """
+    Test the plaintext size computed from the ciphertext size
+    """
+    assert crypt.Cipher.decrypted_size(crypt.FILE_HEADER_SIZE) == 0
+    assert (
+        crypt.Cipher.decrypted_size(
+            crypt.FILE_HEADER_SIZE + crypt.BLOCK_SIZE + 17
+        )
+        == crypt.BLOCK_DATA_SIZE + 1
+    )
+
+    with pytest.raises(crypto.DecryptionError):
+        crypt.Cipher.decrypted_size(crypt.FILE_HEADER_SIZE + 16)
+
+    raw = os.path.join(test_dir, "raw_files", "file4.txt")
+    encrypted = os.path.join(test_dir, "encrypted_files0", "file4.txt.bin")
+    assert crypt.Cipher.decrypted_size(
+        os.path.getsize(encrypted)
+    ) == os.path.getsize(raw)
+
+
+@pytest.mark.parametrize("archive_name", ["out.tar", "out.tar.gz", "out.zip"])
+def test_output_archive(archive_name):
+    """
+    Test that files are decrypted straight into an archive
+    """
+    encrypted_folder = "0f12hh28evsof1kgflv67ldcngbgfa8j4viad0q5ie7mj1n1m490"
+    files = os.path.join(test_dir, encrypted_folder)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        archive_path = os.path.join(temp_dir, archive_name)
+        decrypt.decrypt(
+            files,
+            decrypt_rclone_config_file,
+            engine="native",
+            output_archive=archive_path,
+        )
+
+        out_dir = os.path.join(temp_dir, "out")
+        if archive_name.endswith(".zip"):
+            with zipfile.ZipFile(archive_path) as z:
+                z.extractall(out_dir)
+        else:
+            with tarfile.open(archive_path) as t:
+                t.extractall(out_dir)
+
+        assert compare_files("encrypted_files2", out_dir) is True
+
+
+@pytest.mark.parametrize("archive_name", ["out.tar", "out.zip"])
+def test_output_archive_skips_corrupt_file(archive_name):
+    """
+    Test that a file failing authentication is left out of the archive and
+    the files after it are still added
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        files = os.path.join(temp_dir, "encrypted_files0")
+        shutil.copytree(os.path.join(test_dir, "encrypted_files0"), files)
+        corrupt = os.path.join(files, "file4.txt.bin")
+        with open(corrupt, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last[0] ^ 1]))
+
+        archive_path = os.path.join(temp_dir, archive_name)
+        decrypt.decrypt(
+            files,
+            decrypt_rclone_config_file,
+            engine="native",
+            output_archive=archive_path,
+        )
+
+        if archive_name.endswith(".zip"):
+            with zipfile.ZipFile(archive_path) as z:
+                names = z.namelist()
+        else:
+            with tarfile.open(archive_path) as t:
+                names = t.getnames()
+
+        assert "encrypted_files0/file4.txt" not in names
+        assert sorted(names) == [
+            f"encrypted_files0/sub_folder/file{i}.txt" for i in range(4)
+        ]
+
+
+def test_output_archive_removed_on_failure(monkeypatch):
+    """
+    Test that an archive whose writing fails is not left behind looking
+    complete
+    """
+
+    def add(*args):
+        raise OSError("unexpected end of data")
+
+    monkeypatch.setattr(archive.TarArchiveWriter, "add", add)
+    files = os.path.join(test_dir, "encrypted_files0")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        archive_path = os.path.join(temp_dir, "out.tar")
+        with pytest.raises(archive.ArchiveError):
+            decrypt.decrypt(
+                files,
+                decrypt_rclone_config_file,
+                engine="native",
+                output_archive=archive_path,
+            )
+
+        assert not os.path.exists(archive_path)
+
+
+@pytest.mark.parametrize("archive_name", ["out.tar", "out.zip"])
+def test_output_archive_aborted_mid_file(monkeypatch, archive_name):
+    """
+    Test that a file failing authentication after its member was started
+    aborts the archive instead of leaving a truncated member in it
+    """
+    decrypt_chunks = chunks.decrypt_chunks
+
+    def fail_after_first_block(cipher, reader):
+        blocks = decrypt_chunks(cipher, reader)
+        yield next(blocks)
+        raise crypto.DecryptionError("Failed to authenticate block")
+
+    monkeypatch.setattr(chunks, "decrypt_chunks", fail_after_first_block)
+    files = os.path.join(test_dir, "encrypted_files0")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        archive_path = os.path.join(temp_dir, archive_name)
+        with pytest.raises(archive.ArchiveError):
+            decrypt.decrypt(
+                files,
+                decrypt_rclone_config_file,
+                engine="native",
+                output_archive=archive_path,
+            )
+
+        assert not os.path.exists(archive_path)
+
+
+def test_block_reader():
+    blocks = [b"abc", memoryview(b"defg"), b"", b"h"]
+    with archive.open_blocks(blocks) as f:
+        assert f.read(5) == b"abcde"
+        assert f.read() == b"fgh"
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_dedup(workers):
+    """
+    Test that copies of the same encrypted file are decrypted once and
+    hardlinked
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        files = os.path.join(temp_dir, "encrypted_files1")
+        shutil.copytree(os.path.join(test_dir, "encrypted_files1"), files)
+        shutil.copytree(
+            os.path.join(files, "sub_folder"), os.path.join(files, "sub_copy")
+        )
+
+        out_dir = os.path.join(temp_dir, "out")
+        decrypt.decrypt(
+            files,
+            decrypt_rclone_config_file,
+            out_dir,
+            engine="native",
+            workers=workers,
+            dedup_method="hardlink",
+        )
+
+        assert compare_files("encrypted_files1", out_dir) is True
+        for i in range(0, 4):
+            assert os.path.samefile(
+                os.path.join(
+                    out_dir, "encrypted_files1", "sub_folder", f"file{i}.txt"
+                ),
+                os.path.join(
+                    out_dir, "encrypted_files1", "sub_copy", f"file{i}.txt"
+                ),
+            )
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_dedup_skips_failed_primary(workers):
+    """
+    Test that copies are not linked to a file left at the output path of
+    their primary by an earlier run when the primary fails to decrypt
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        files = os.path.join(temp_dir, "encrypted_files1")
+        shutil.copytree(os.path.join(test_dir, "encrypted_files1"), files)
+        sub_folder = os.path.join(files, "sub_folder")
+        for name in os.listdir(sub_folder):
+            with open(os.path.join(sub_folder, name), "r+b") as f:
+                f.seek(-1, os.SEEK_END)
+                last = f.read(1)
+                f.seek(-1, os.SEEK_END)
+                f.write(bytes([last[0] ^ 1]))
+        shutil.copytree(sub_folder, os.path.join(files, "sub_copy"))
+
+        out_dir = os.path.join(temp_dir, "out")
+        outputs = []
+        for folder in ["sub_folder", "sub_copy"]:
+            os.makedirs(os.path.join(out_dir, "encrypted_files1", folder))
+            for i in range(0, 4):
+                path = os.path.join(
+                    out_dir, "encrypted_files1", folder, f"file{i}.txt"
+                )
+                with open(path, "w") as f:
+                    f.write("stale")
+                outputs.append(path)
+
+        decrypt.decrypt(
+            files,
+            decrypt_rclone_config_file,
+            out_dir,
+            engine="native",
+            workers=workers,
+            dedup_method="hardlink",
+        )
+
+        for path in outputs:
+            assert os.stat(path).st_nlink == 1
+            with open(path) as f:
+                assert f.read() == "stale"
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_chunked_files(workers):
+    """
+    Test that files split by rclone chunker over a crypt remote are joined
+    back into single files
+    """
+    files = os.path.join(test_dir, "chunked_files")
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        decrypt.decrypt(
+            files,
+            decrypt_rclone_config_file,
+            out_dir,
+            engine="native",
+            workers=workers,
+        )
+
+        assert compare_files("chunked_files", out_dir) is True
+        for _, _, names in os.walk(out_dir):
+            assert not any(".rclone_chunk." in name for name in names)
+
+
+def test_chunked_files_archive():
+    """
+    Test that chunked files are joined into archive members
+    """
+    files = os.path.join(test_dir, "chunked_files")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        archive_path = os.path.join(temp_dir, "out.tar")
+        decrypt.decrypt(
+            files,
+            decrypt_rclone_config_file,
+            engine="native",
+            output_archive=archive_path,
+        )
+
+        out_dir = os.path.join(temp_dir, "out")
+        with tarfile.open(archive_path) as t:
+            t.extractall(out_dir)
+
+        assert compare_files("chunked_files", out_dir) is True
@@ -5,6 +5,7 @@ import filecmp
 import pytest
 import os
 import shutil
+import subprocess
 import tempfile
 
 decrypt_rclone_config_file = os.path.join("tests", "rclone_decrypt.conf")
@@ -46,6 +47,8 @@ def test_version():
             if len(version_info) == 2:
                 expected_version = version_info[1].strip('\\"').strip('\\"\n')
                 assert __version__ == expected_version
+                # Later matches are versions of dependencies
+                break
 
 
 def smart_cmp(f1, f2):
@@ -189,6 +192,162 @@ def test_individual_file():
         assert file_match is True
 
 
+def read_tree(root: str) -> dict:
+    tree = {}
+    for dir_path, _, files in os.walk(root):
+        for f in files:
+            path = os.path.join(dir_path, f)
+            with open(path, "rb") as fin:
+                tree[os.path.relpath(path, root)] = fin.read()
+    return tree
+
+
+def test_selection_matches_individual_files():
+    """
+    Test that a selection of files and folders decrypted as one, with its
+    files coalesced into rclone jobs, ends up where decrypting each entry
+    on its own puts it
+    """
+    selected = [os.path.join(test_dir, "encrypted_files1")]
+    for folder in [
+        "encrypted_files0",
+        "encrypted_files1",
+        "0f12hh28evsof1kgflv67ldcngbgfa8j4viad0q5ie7mj1n1m490",
+    ]:
+        for dir_path, _, files in os.walk(os.path.join(test_dir, folder)):
+            selected += [os.path.join(dir_path, f) for f in sorted(files)]
+
+    with tempfile.TemporaryDirectory() as one_by_one:
+        for path in selected:
+            decrypt.decrypt(path, decrypt_rclone_config_file, one_by_one)
+
+        with tempfile.TemporaryDirectory() as coalesced:
+            decrypt.decrypt(selected, decrypt_rclone_config_file, coalesced)
+
+            assert read_tree(coalesced) == read_tree(one_by_one)
+
+
+def test_selection_skips_stray_files():
+    """
+    Test that a file no remote decrypts, like a .DS_Store in a folder added
+    from the GUI, is skipped instead of making the whole selection fall
+    back to one rclone copy per file
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        encrypted = os.path.join(temp_dir, "encrypted_files1")
+        shutil.copytree(os.path.join(test_dir, "encrypted_files1"), encrypted)
+        sub_folder = os.path.join(encrypted, "sub_folder")
+        with open(os.path.join(sub_folder, ".DS_Store"), "wb") as f:
+            f.write(b"\0" * 16)
+
+        selected = sorted(
+            os.path.join(sub_folder, f) for f in os.listdir(sub_folder)
+        )
+        out_dir = os.path.join(temp_dir, "out")
+        assert decrypt.rclone_copy_files(
+            selected, decrypt_rclone_config_file, out_dir
+        )
+
+        assert sorted(os.listdir(out_dir)) == [
+            f"file{i}.txt" for i in range(4)
+        ]
+
+
+def test_selection_unsupported_name_encoding():
+    """
+    Test that a selection of files whose names the native engine cannot
+    decrypt is decrypted one by one by rclone instead of being skipped
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config = os.path.join(temp_dir, "rclone.conf")
+        encrypted = os.path.join(temp_dir, "encrypted")
+        with open(config, "w") as f:
+            f.write(
+                "[crypt32768]\n"
+                "type = crypt\n"
+                f"remote = {encrypted}\n"
+                "filename_encryption = standard\n"
+                "directory_name_encryption = false\n"
+                "filename_encoding = base32768\n"
+                "password = 93d7c9f6ba96af117ac2094cbcd9e4d64c634903\n"
+            )
+        subprocess.run(
+            [
+                "rclone",
+                "--config",
+                config,
+                "copy",
+                os.path.join(test_dir, "raw_files", "sub_folder"),
+                "crypt32768:",
+            ],
+            check=True,
+        )
+
+        selected = sorted(
+            os.path.join(encrypted, f) for f in os.listdir(encrypted)
+        )
+        out_dir = os.path.join(temp_dir, "out")
+        decrypt.decrypt(selected, config, out_dir)
+
+        assert sorted(os.listdir(out_dir)) == [
+            f"file{i}.txt" for i in range(4)
+        ]
+
+
+def test_chunked_files():
+    """
+    Test that rclone joins files split by chunker over a crypt remote, for
+    a folder and for a selection of the chunks
+    """
+    folder = os.path.join(test_dir, "chunked_files")
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        decrypt.decrypt(folder, decrypt_rclone_config_file, out_dir)
+        assert compare_files("chunked_files", out_dir) is True
+
+    sub_folder = os.path.join(folder, "sub_folder")
+    selected = sorted(
+        os.path.join(sub_folder, f) for f in os.listdir(sub_folder)
+    )
+    with tempfile.TemporaryDirectory() as out_dir:
+        decrypt.decrypt(selected, decrypt_rclone_config_file, out_dir)
+        assert sorted(os.listdir(out_dir)) == [
+            f"file{i}.txt" for i in range(4)
+        ]
+        for i in range(4):
+            assert smart_cmp(
+                os.path.join(
+                    test_dir, "raw_files", "sub_folder", f"file{i}.txt"
+                ),
+                os.path.join(out_dir, f"file{i}.txt"),
+            )
+
+
+def test_chunked_files_selection_native():
+    """
+    Test that the native engine joins chunks selected one by one, like it
+    does the chunks in a folder
+    """
+    sub_folder = os.path.join(test_dir, "chunked_files", "sub_folder")
+    selected = sorted(
+        os.path.join(sub_folder, f) for f in os.listdir(sub_folder)
+    )
+    with tempfile.TemporaryDirectory() as out_dir:
+        decrypt.decrypt(
+            selected, decrypt_rclone_config_file, out_dir, engine="native"
+        )
+        assert sorted(os.listdir(out_dir)) == [
+            f"file{i}.txt" for i in range(4)
+        ]
+        for i in range(4):
+            assert smart_cmp(
+                os.path.join(
+                    test_dir, "raw_files", "sub_folder", f"file{i}.txt"
+                ),
+                os.path.join(out_dir, f"file{i}.txt"),
+            )
+
+
 def test_no_config_file():
     """
     Test behavior when provided no config file
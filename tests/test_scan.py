@@ -0,0 +1,75 @@
+from rclone_decrypt import scan
+
+import os
+import pytest
+import tempfile
+
+test_dir = "tests"
+
+
+def os_walk_files(top: str) -> set:
+    return {
+        os.path.join(root, f) for root, _, files in os.walk(top) for f in files
+    }
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+def test_matches_os_walk(threads):
+    """
+    Test that every directory and file os.walk finds is yielded once, and
+    each directory before its subdirectories
+    """
+    seen = []
+    files = []
+    for path, dirs, dir_files in scan.walk(test_dir, threads=threads):
+        if path != test_dir:
+            assert os.path.dirname(path) in seen
+        seen.append(path)
+        files += [f.path for f in dir_files]
+        assert all(d.is_dir() for d in dirs)
+
+    assert sorted(seen) == sorted(root for root, _, _ in os.walk(test_dir))
+    assert len(files) == len(set(files))
+    assert set(files) == os_walk_files(test_dir)
+    assert {f.path for f in scan.iter_files(test_dir)} == set(files)
+
+
+def test_descend():
+    """
+    Test that directories descend rejects are neither yielded nor walked
+    """
+    paths = [
+        path
+        for path, _, _ in scan.walk(test_dir, lambda d: d.name != "raw_files")
+    ]
+
+    assert os.path.join(test_dir, "raw_files") not in paths
+    assert os.path.join(test_dir, "raw_files", "sub_folder") not in paths
+    assert os.path.join(test_dir, "encrypted_files1", "sub_folder") in paths
+
+
+def test_descend_error():
+    def descend(entry):
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        list(scan.walk(test_dir, descend))
+
+
+def test_missing_directory():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        missing = os.path.join(temp_dir, "missing")
+        assert list(scan.walk(missing)) == []
+
+
+def test_stop_early():
+    """
+    Test that closing the generator early stops the scan
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for i in range(50):
+            os.makedirs(os.path.join(temp_dir, str(i), "sub"))
+
+        walker = scan.walk(temp_dir, threads=2)
+        next(walker)
+        walker.close()
@@ -0,0 +1,67 @@
+from rclone_decrypt import crypt
+from rclone_decrypt import crypto
+from rclone_decrypt import selection
+
+import os
+import tempfile
+
+decrypt_rclone_config_file = os.path.join("tests", "rclone_decrypt.conf")
+test_dir = "tests"
+
+
+def test_plan_jobs():
+    """
+    Test that selected files share one job under their common parent while
+    folders keep their own, dropping repeated and missing paths
+    """
+    with tempfile.TemporaryDirectory() as root:
+        for d in ["a", os.path.join("a", "b"), "c"]:
+            os.mkdir(os.path.join(root, d))
+        files = [
+            os.path.join(root, "a", "b", "x"),
+            os.path.join(root, "a", "y"),
+        ]
+        for f in files:
+            open(f, "w").close()
+
+        jobs = selection.plan_jobs(
+            [
+                files[0],
+                os.path.join(root, "c"),
+                files[1],
+                files[0],
+                os.path.join(root, "missing"),
+            ]
+        )
+
+        assert jobs == [
+            (os.path.join(root, "a"), [os.path.join("b", "x"), "y"]),
+            (os.path.join(root, "c"), None),
+        ]
+
+
+def test_group_by_root():
+    """
+    Test that files are only grouped under directories whose names all
+    decrypt, as the crypt remote is rooted there
+    """
+    remotes = crypt.read_crypt_remotes(decrypt_rclone_config_file)
+    cipher = crypt.Cipher.from_config(
+        remotes["crypt2"], crypto.get_backend("python")
+    )
+
+    encrypted = os.path.abspath(
+        os.path.join(
+            test_dir, "0f12hh28evsof1kgflv67ldcngbgfa8j4viad0q5ie7mj1n1m490"
+        )
+    )
+    paths = []
+    for dir_path, _, files in os.walk(encrypted):
+        paths += [os.path.join(dir_path, f) for f in sorted(files)]
+
+    groups = selection.group_by_root(cipher, paths)
+
+    assert groups == [(encrypted, paths)]
+    for path in paths:
+        rel = os.path.relpath(path, encrypted)
+        assert selection.decrypt_relative_path(cipher, rel)
@@ -0,0 +1,121 @@
+from rclone_decrypt import crypto
+from rclone_decrypt import serve
+
+import os
+import pytest
+import shutil
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+
+decrypt_rclone_config_file = os.path.join("tests", "rclone_decrypt.conf")
+test_dir = "tests"
+
+
+@pytest.fixture()
+def server():
+    root = os.path.join(test_dir, "encrypted_files1")
+    cipher = serve.pick_cipher(
+        root, decrypt_rclone_config_file, backend=crypto.get_backend("python")
+    )
+    httpd = serve.make_server(root, cipher, port=0)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def fetch(url: str, headers: dict = None) -> tuple:
+    request = urllib.request.Request(url, headers=headers or {})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as err:
+        return err.code, err.headers, b""
+
+
+def read_raw(*path) -> bytes:
+    with open(os.path.join(test_dir, "raw_files", *path), "rb") as f:
+        return f.read()
+
+
+def test_serve_files(server):
+    """
+    Test that plaintext names are listed and contents served decrypted
+    """
+    status, _, body = fetch(f"{server}/")
+    assert status == 200
+    assert b'href="file4.txt"' in body
+    assert b'href="sub_folder/"' in body
+
+    status, headers, body = fetch(f"{server}/sub_folder/file2.txt")
+    assert status == 200
+    assert body == read_raw("sub_folder", "file2.txt")
+    assert headers["Content-Length"] == str(len(body))
+
+    assert fetch(f"{server}/missing.txt")[0] == 404
+    assert fetch(f"{server}/sub_folder/../file4.txt")[0] == 404
+
+
+@pytest.mark.parametrize(
+    "header, start, end",
+    [("bytes=0-4", 0, 5), ("bytes=3-", 3, None), ("bytes=-4", -4, None)],
+)
+def test_serve_range(server, header, start, end):
+    """
+    Test that Range requests return the requested slice of the plaintext
+    """
+    raw = read_raw("file4.txt")
+    status, headers, body = fetch(f"{server}/file4.txt", {"Range": header})
+
+    assert status == 206
+    assert body == raw[start:end]
+    assert headers["Content-Range"].endswith(f"/{len(raw)}")
+
+
+def test_serve_unsatisfiable_range(server):
+    size = len(read_raw("file4.txt"))
+    status, headers, _ = fetch(
+        f"{server}/file4.txt", {"Range": f"bytes={size}-"}
+    )
+
+    assert status == 416
+    assert headers["Content-Range"] == f"bytes */{size}"
+
+
+def test_chunk_cache_bound():
+    cache = serve.ChunkCache(10)
+    for i in range(5):
+        cache.put(i, b"abcd")
+
+    assert cache.size <= 10
+    assert cache.get(0) is None
+    assert cache.get(4) == b"abcd"
+
+
+def test_pick_cipher_nested_names():
+    """
+    Test that names one level down pick the remote when the root only
+    holds directories with unencrypted names, and that the first remote is
+    used when no remote decrypts anything
+    """
+    backend = crypto.get_backend("python")
+    with tempfile.TemporaryDirectory() as root:
+        shutil.copytree(
+            os.path.join(test_dir, "encrypted_files1", "sub_folder"),
+            os.path.join(root, "sub_folder"),
+        )
+        cipher = serve.pick_cipher(
+            root, decrypt_rclone_config_file, backend=backend
+        )
+        assert cipher.decrypt_file_name("2j53sgn29mcsvuniiiuiv4o7ng") == (
+            "file4.txt"
+        )
+
+    with tempfile.TemporaryDirectory() as root:
+        cipher = serve.pick_cipher(
+            root, decrypt_rclone_config_file, backend=backend
+        )
+        assert cipher.decrypt_file_name("file4.txt.bin") == "file4.txt"
@@ -0,0 +1,86 @@
+from rclone_decrypt import decrypt
+from rclone_decrypt import tuning
+
+import logging
+import os
+import pytest
+import tempfile
+
+test_dir = "tests"
+
+
+def test_sample_workload():
+    """
+    Test that every file is counted and sizes come from the sample
+    """
+    with tempfile.TemporaryDirectory() as root:
+        os.mkdir(os.path.join(root, "sub"))
+        for i, size in enumerate([10, 20, 30]):
+            with open(os.path.join(root, "sub", str(i)), "wb") as f:
+                f.write(b"\0" * size)
+
+        workload = tuning.sample_workload(root)
+        assert workload.count == 3
+        assert workload.total_bytes == 60
+        assert workload.median == 20
+
+        workload = tuning.sample_workload(root, sample_size=1)
+        assert workload.count == 3
+        assert len(workload.sizes) == 1
+        assert workload.complete
+
+        workload = tuning.sample_workload(root, max_files=2)
+        assert workload.count == 2
+        assert not workload.complete
+        assert str(workload).startswith("at least 2 files")
+
+        workload = tuning.sample_workload(root, time_budget=0)
+        assert not workload.complete
+
+
+def test_choose_flags():
+    """
+    Test that auto tunes for the shape of the workload
+    """
+    small = tuning.Workload(100000, [4096] * 100)
+    large = tuning.Workload(2, [1024**3, 1024**3])
+
+    assert tuning.choose_flags("auto", small, 8) == tuning.small_files_flags(8)
+    assert tuning.choose_flags("auto", large, 8) == dict(
+        tuning.large_files_flags(8), **{"--transfers": 2}
+    )
+    assert tuning.choose_flags("default", small, 8) == {}
+    assert tuning.choose_flags("auto", tuning.Workload(0, []), 8) == {}
+
+    few = tuning.Workload(3, [4096] * 3)
+    assert tuning.choose_flags("auto", few, 8)["--transfers"] == 3
+
+
+def test_unknown_profile():
+    with pytest.raises(ValueError):
+        tuning.choose_flags("fastest")
+
+
+def test_only_auto_samples(monkeypatch):
+    def sample_workload(paths):
+        raise AssertionError("sampled")
+
+    monkeypatch.setattr(tuning, "sample_workload", sample_workload)
+    for profile in ["default", "small-files", "large-files"]:
+        assert decrypt.sample_for_profile(profile, test_dir) is None
+
+
+def test_log_throughput(caplog):
+    """
+    Test that the throughput of an incomplete workload, whose size is only
+    a lower bound, is not logged
+    """
+    caplog.set_level(logging.INFO, logger="rclone_decrypt")
+
+    tuning.log_throughput(tuning.Workload(2, [1024**2] * 2), 2.0)
+    assert "Decrypted 2 files, ~2.0MiB in 2.00s (1.0MiB/s)" in caplog.text
+
+    caplog.clear()
+    tuning.log_throughput(tuning.Workload(2, [1024**2] * 2, False), 2.0)
+    assert "Decrypted at least 2 files, at least ~2.0MiB" in caplog.text
+    assert "MiB/s" not in caplog.text
@@ -0,0 +1,153 @@
+from rclone_decrypt import decrypt
+from rclone_decrypt import workqueue
+from tests.test_rclone_decrypt import compare_files
+
+import os
+import pytest
+import tempfile
+import time
+
+decrypt_rclone_config_file = os.path.join("tests", "rclone_decrypt.conf")
+
+
+def test_expired_lease_is_retried():
+    """
+    Test that a task leased by a worker which died is handed out again once
+    its lease expires, and fails once it has used up its attempts
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "queue.sqlite")
+        with workqueue.WorkQueue(path, lease_seconds=0, max_attempts=2) as q:
+            assert q.put([("crypt0", "a", "b")]) == 1
+            # Enqueueing the same job again does not duplicate it
+            assert q.put([("crypt0", "a", "b")]) == 0
+
+            task_id = q.claim("dead_worker")[0]
+            assert q.claim("worker")[0] == task_id
+            assert q.claim("worker") is None
+            assert q.is_finished()
+            assert q.counts() == {"failed": 1}
+
+
+def test_ack_and_fail():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "queue.sqlite")
+        with workqueue.WorkQueue(path) as q:
+            q.put([("crypt0", "a", "b"), ("crypt0", "c", "d")])
+
+            first = q.claim("worker")
+            second = q.claim("worker")
+            assert q.claim("worker") is None
+            assert not q.is_finished()
+
+            assert q.ack(first[0], "worker")
+            assert q.fail(second[0], "worker", "bad", retry=False)
+            assert q.is_finished()
+            assert q.failed() == [("c", "bad")]
+            assert q.done() == ["b"]
+
+
+def test_stale_worker_cannot_ack():
+    """
+    Test that a worker whose lease expired and was handed to another worker
+    can neither ack nor fail the task
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "queue.sqlite")
+        with workqueue.WorkQueue(path, lease_seconds=0) as q:
+            q.put([("crypt0", "a", "b")])
+
+            task_id = q.claim("a")[0]
+            assert q.claim("b")[0] == task_id
+            assert q.fail(task_id, "b", "transient")
+
+            assert not q.ack(task_id, "a")
+            assert not q.fail(task_id, "a", "late")
+            assert not q.renew(task_id, "a")
+            assert q.counts() == {"pending": 1}
+
+
+def test_heartbeat_renews_lease():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "queue.sqlite")
+        with workqueue.WorkQueue(path, lease_seconds=0.3) as q:
+            q.put([("crypt0", "a", "b")])
+            task_id = q.claim("a")[0]
+
+            with workqueue.LeaseHeartbeat(path, task_id, "a", 0.3):
+                time.sleep(1)
+                assert q.claim("b") is None
+
+            assert q.ack(task_id, "a")
+
+
+def test_enqueuing_keeps_workers_waiting():
+    """
+    Test that the queue is not finished while tasks are still being added,
+    and that they can be claimed before the rest are
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "queue.sqlite")
+        with workqueue.WorkQueue(path) as q:
+            q.start_enqueuing()
+            assert not q.is_finished()
+
+            with workqueue.WorkQueue(path) as worker:
+                for i in range(3):
+                    q.put([("crypt0", str(i), str(i))])
+                    task_id, _, src, _ = worker.claim("w")
+                    assert src == str(i)
+                    worker.ack(task_id, "w")
+                    assert not worker.is_finished()
+
+                # The same src to a different output is a new task
+                assert q.put([("crypt0", "0", "elsewhere")]) == 1
+                q.finish_enqueuing()
+                task_id = worker.claim("w")[0]
+                worker.ack(task_id, "w")
+                assert worker.is_finished()
+
+
+def test_sharded_decrypt():
+    """
+    Test that files split between worker processes are all decrypted
+    """
+    folder = "0f12hh28evsof1kgflv67ldcngbgfa8j4viad0q5ie7mj1n1m490"
+    files = os.path.join("tests", folder)
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        decrypt.decrypt(
+            files,
+            decrypt_rclone_config_file,
+            out_dir,
+            engine="native",
+            workers=2,
+        )
+
+        assert compare_files("encrypted_files2", out_dir) is True
+
+
+def crashing_worker(*args, **kwargs):
+    os._exit(3)
+
+
+def test_sharded_worker_crash(monkeypatch):
+    """
+    Test that workers which die are reported instead of the job completing
+    with files left in the queue, and that a bad config fails before any
+    worker is started
+    """
+    folder = "0f12hh28evsof1kgflv67ldcngbgfa8j4viad0q5ie7mj1n1m490"
+    files = os.path.join("tests", folder)
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        monkeypatch.setattr(decrypt, "run_worker", crashing_worker)
+        with pytest.raises(decrypt.WorkerError, match="2 of 2 workers"):
+            decrypt.sharded_copy(
+                files, decrypt_rclone_config_file, out_dir, workers=2
+            )
+
+        with pytest.raises(decrypt.ConfigFileError):
+            decrypt.sharded_copy(
+                files, os.path.join(out_dir, "missing.conf"), out_dir
+            )
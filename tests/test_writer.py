@@ -0,0 +1,119 @@
+from rclone_decrypt import decrypt
+from rclone_decrypt import writer
+from tests.test_rclone_decrypt import compare_files
+
+import os
+import pytest
+import tempfile
+
+decrypt_rclone_config_file = os.path.join("tests", "rclone_decrypt.conf")
+test_dir = "tests"
+
+
+@pytest.mark.parametrize("fsync", writer.fsync_choices)
+def test_fsync_modes(fsync):
+    """
+    Test that every fsync mode decrypts correctly and leaves no temporary
+    files behind
+    """
+    files = os.path.join(test_dir, "encrypted_files1")
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        decrypt.decrypt(
+            files,
+            decrypt_rclone_config_file,
+            out_dir,
+            engine="native",
+            fsync=fsync,
+        )
+
+        assert compare_files("encrypted_files1", out_dir) is True
+        for _, _, names in os.walk(out_dir):
+            assert not [n for n in names if n.endswith(".partial")]
+
+
+def test_write_file_coalesces_chunks():
+    """
+    Test that chunks smaller and larger than the buffer are written in order
+    and that a size mismatch is truncated away
+    """
+    chunks = [b"a" * 3, b"b" * 5, b"c" * 20, b"d" * 2]
+    expected = b"".join(chunks)
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        dst = os.path.join(out_dir, "sub", "file")
+        with writer.OutputWriter("batch", buffer_size=8, batch_files=1) as w:
+            written = w.write_file(dst, len(expected) + 100, iter(chunks))
+
+        assert written == len(expected)
+        with open(dst, "rb") as f:
+            assert f.read() == expected
+
+
+def test_batch_renames_after_fsync(monkeypatch):
+    """
+    Test that in batch mode files only get their final names once their
+    data has been fsynced
+    """
+    events = []
+    monkeypatch.setattr(
+        writer, "fsync_path", lambda path: events.append(("fsync", path))
+    )
+    replace = os.replace
+
+    def record_replace(src, dst):
+        events.append(("replace", dst))
+        replace(src, dst)
+
+    monkeypatch.setattr(writer.os, "replace", record_replace)
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        dst = os.path.join(out_dir, "file")
+        with writer.OutputWriter("batch") as w:
+            w.write_file(dst, 3, [b"abc"])
+            assert not os.path.exists(dst)
+            # Writing the same file again flushes the first version
+            w.write_file(dst, 3, [b"def"])
+            assert os.path.exists(dst)
+
+        temp = writer.OutputWriter.temp_path(dst)
+        assert (
+            events
+            == [
+                ("fsync", temp),
+                ("replace", dst),
+                ("fsync", out_dir),
+            ]
+            * 2
+        )
+        assert os.listdir(out_dir) == ["file"]
+        with open(dst, "rb") as f:
+            assert f.read() == b"def"
+
+
+def test_write_file_failure():
+    """
+    Test that a failed write removes the temporary file and keeps the
+    existing destination
+    """
+
+    def chunks():
+        yield b"new"
+        raise OSError("read failed")
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        dst = os.path.join(out_dir, "file")
+        with open(dst, "wb") as f:
+            f.write(b"old")
+
+        with pytest.raises(OSError):
+            writer.OutputWriter().write_file(dst, 3, chunks())
+
+        assert os.listdir(out_dir) == ["file"]
+        with open(dst, "rb") as f:
+            assert f.read() == b"old"
+
+
+def test_unknown_fsync():
+    with pytest.raises(ValueError):
+        writer.OutputWriter("sometimes")